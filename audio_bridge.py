@@ -0,0 +1,38 @@
+from pydub import AudioSegment
+import numpy
+
+SAMPLE_TYPES = {1: numpy.int8, 2: numpy.int16, 4: numpy.int32}
+
+def sample_type(sample_width):
+    if sample_width not in SAMPLE_TYPES:
+        raise ValueError("Unsupported sample width: " + str(sample_width))
+    return SAMPLE_TYPES[sample_width]
+
+def segment_samples(segment):
+    # (frames, channels) view on the pcm of the segment, read only as long as the segment owns bytes
+    pcm = numpy.frombuffer(segment._data, dtype=sample_type(segment.sample_width))
+    return pcm.reshape(-1, segment.channels)
+
+def frame_samples(samples, sample_width):
+    samples = numpy.ascontiguousarray(samples, dtype=sample_type(sample_width))
+    return samples.reshape(-1, 1) if samples.ndim == 1 else samples
+
+def samples_segment(samples, frame_rate, sample_width):
+    # segments that leave the render path own bytes, pydub's operators and get_array_of_samples only work on those
+    samples = frame_samples(samples, sample_width)
+    return AudioSegment(data=samples.tobytes(), sample_width=sample_width, frame_rate=frame_rate, channels=samples.shape[1])
+
+def view_segment(samples, frame_rate, sample_width):
+    # zero copy, the segment keeps the array alive through the memoryview
+    # only for segments that stay inside the render path, pydub's operators cannot concatenate memoryviews
+    samples = frame_samples(samples, sample_width)
+    return AudioSegment(data=memoryview(samples.reshape(-1).view(numpy.uint8)), sample_width=sample_width, frame_rate=frame_rate, channels=samples.shape[1])
+
+def segment_nbytes(segment):
+    return memoryview(segment._data).nbytes
+
+def detach_segment(segment):
+    # memoryviews cannot be pickled, the copy is the one pickling would make anyway
+    if isinstance(segment._data, bytes):
+        return segment
+    return segment._spawn(bytes(segment._data))
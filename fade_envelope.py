@@ -0,0 +1,123 @@
+from pydub.utils import db_to_float
+from audio_bridge import segment_samples, view_segment, SAMPLE_TYPES
+from memory_lru import MemoryBoundedLRU
+import numpy
+
+FADE_LINEAR = "linear"
+FADE_EQUAL_POWER = "equal_power"
+FADE_EXPONENTIAL = "exponential"
+FADE_CURVES = [FADE_LINEAR, FADE_EQUAL_POWER, FADE_EXPONENTIAL]
+
+# envelopes are shared by every generator in the process, every fade setting tried in the ui adds one
+ENVELOPE_CACHE_BYTES = 16 * 1024 * 1024
+
+envelopes = MemoryBoundedLRU.create(ENVELOPE_CACHE_BYTES, lambda x: x.nbytes)
+
+def fade_frames(frame_rate, start, duration):
+    ms_frames = frame_rate / 1000.0
+    return (int(start * ms_frames), int((start + duration) * ms_frames))
+
+def curve_gains(positions, from_power, to_power, curve):
+    if curve == FADE_EQUAL_POWER:
+        # linear in power, the gains of a fade-in and a fade-out always add up to full power
+        return numpy.sqrt(from_power * from_power + (to_power * to_power - from_power * from_power) * positions)
+    if curve == FADE_EXPONENTIAL:
+        # linear in dB
+        return from_power * (to_power / from_power) ** positions
+    return from_power + (to_power - from_power) * positions
+
+def fade_envelope(frame_rate, start, duration, from_gain, to_gain, curve=FADE_LINEAR, dtype=numpy.float64):
+    # gain of every frame from int(start) on, shared by all shots and variations with the same fade
+    key = (frame_rate, start, duration, from_gain, to_gain, curve, numpy.dtype(dtype).str)
+    envelope = envelopes.get(key)
+    if envelope is not None:
+        return envelope
+
+    if curve not in FADE_CURVES:
+        raise ValueError("Unknown fade curve: " + str(curve))
+
+    from_power = db_to_float(from_gain)
+    to_power = db_to_float(to_gain)
+    ms_frames = frame_rate / 1000.0
+
+    # pydub steps the gain once per ms for fades over 100 ms and once per frame below
+    if duration > 100:
+        bounds = (numpy.arange(start, start + duration + 1) * ms_frames).astype(numpy.int64)
+        if curve == FADE_LINEAR:
+            steps = from_power + ((to_power - from_power) / duration) * numpy.arange(duration)
+        else:
+            steps = curve_gains(numpy.arange(duration) / duration, from_power, to_power, curve)
+        envelope = numpy.repeat(steps, numpy.diff(bounds))
+    else:
+        frames = (start + duration) * ms_frames - start * ms_frames
+        if curve == FADE_LINEAR:
+            envelope = from_power + ((to_power - from_power) / frames) * numpy.arange(int(frames))
+        else:
+            envelope = curve_gains(numpy.arange(int(frames)) / frames, from_power, to_power, curve)
+
+    envelope = envelope.astype(dtype)
+    envelope.flags.writeable = False
+    envelopes.put(key, envelope)
+    return envelope
+
+def apply_fade(samples, frame_rate, start, duration, from_gain, to_gain, curve=FADE_LINEAR):
+    # in place on float samples, frames past the end of the samples are dropped
+    envelope = fade_envelope(frame_rate, start, duration, from_gain, to_gain, curve, samples.dtype)
+    start_frame, end_frame = fade_frames(frame_rate, start, duration)
+
+    envelope = envelope[:max(len(samples) - start_frame, 0)]
+    samples[start_frame:start_frame + len(envelope)] *= envelope[:, None]
+
+    if from_gain != 0:
+        samples[:start_frame] *= samples.dtype.type(db_to_float(from_gain))
+    if to_gain != 0:
+        samples[end_frame:] *= samples.dtype.type(db_to_float(to_gain))
+
+def ms_frames_range(frames, ms_frames, start, end):
+    # frames of pydub's segment[start:end], past the data it pads with silence as long as the slice starts inside
+    first = int(start * ms_frames)
+    if first >= frames:
+        return numpy.arange(0)
+    return numpy.arange(first, int(end * ms_frames))
+
+def fade_layout(segment, start, duration):
+    # source frame of every output frame of pydub's fade, which slices by ms and may pad or drop frames at the end
+    frames = int(segment.frame_count())
+    ms_frames = segment.frame_rate / 1000.0
+    len_segment = len(segment)
+    end = start + duration
+
+    before = ms_frames_range(frames, ms_frames, 0, start)
+    if duration > 100:
+        # one slice per ms, those are not clamped to the length of the segment
+        chunks = numpy.flatnonzero((numpy.arange(start, end) * ms_frames).astype(numpy.int64) < frames)
+        last = start + chunks[-1] + 1 if len(chunks) else start
+        fade = ms_frames_range(frames, ms_frames, start, last)
+    else:
+        fade_length = end * ms_frames - start * ms_frames
+        fade = (start * ms_frames + numpy.arange(int(fade_length))).astype(numpy.int64)
+        # single frames past the data are skipped instead of padded
+        fade = fade[fade < frames]
+    after = ms_frames_range(frames, ms_frames, min(end, len_segment), len_segment)
+    return (before, fade, after)
+
+def fade_segment(segment, from_gain=0, to_gain=0, start=0, duration=0, curve=FADE_LINEAR):
+    if to_gain == 0 and from_gain == 0:
+        return segment
+
+    start = min(len(segment), start)
+    before, fade, after = fade_layout(segment, start, duration)
+    envelope = fade_envelope(segment.frame_rate, start, duration, from_gain, to_gain, curve)
+    gains = numpy.concatenate((numpy.full(len(before), db_to_float(from_gain)), envelope[:len(fade)], numpy.full(len(after), db_to_float(to_gain))))
+
+    samples = segment_samples(segment)
+    indices = numpy.concatenate((before, fade, after))
+    padding = indices >= len(samples)
+
+    # same gains audioop.mul applies, rounded down like audioop
+    faded = samples.take(numpy.minimum(indices, max(len(samples) - 1, 0)), axis=0).astype(numpy.float64)
+    faded *= gains[:, None]
+    numpy.floor(faded, out=faded)
+    faded[padding] = 0
+    # only ever trimmed afterwards, which copies into the returned render
+    return view_segment(faded.astype(SAMPLE_TYPES[segment.sample_width]), segment.frame_rate, segment.sample_width)
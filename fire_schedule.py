@@ -0,0 +1,101 @@
+import numpy, json
+
+STREAM_TAIL = "tail"
+STREAM_BURST = "burst"
+STREAM_LOOP = "loop"
+STREAMS = [STREAM_TAIL, STREAM_BURST, STREAM_LOOP]
+
+def schedule_rng(seed, stream, variation):
+    # same as spawning the root sequence and taking child number <variation>
+    # SeedSequence only takes non negative entropy, negative seeds get a sign word so -s and s draw different schedules
+    seed = int(seed)
+    entropy = [seed, STREAMS.index(stream)] if seed >= 0 else [-seed, STREAMS.index(stream), 1]
+    sequence = numpy.random.SeedSequence(entropy, spawn_key=(variation,))
+    return numpy.random.Generator(numpy.random.Philox(sequence))
+
+def offset_ranges(samples):
+    return numpy.array([sample.rand_offset_cents for sample in samples], dtype=numpy.int64)
+
+def draw_cents(rng, ranges):
+    # whole cents in [-range, range), a range of 0 always gives 0
+    return rng.integers(0, numpy.maximum(2 * ranges, 1)) - ranges
+
+def draw_sequence(rng, samples, count):
+    indices = rng.integers(len(samples), size=count)
+
+    solo = [i for i in range(len(samples)) if samples[i].solo]
+    if len(solo) > 0:
+        indices[:] = solo[0]
+
+    cents = draw_cents(rng, offset_ranges(samples)[indices])
+    return (indices, cents)
+
+def draw_tails(rng, samples):
+    return draw_cents(rng, offset_ranges(samples))
+
+class SequenceSchedule:
+    def __init__(self, sample_paths, sample_ids, cents, offsets, frame_rate, channels, sample_width, mono, downmix_from):
+        self.sample_paths = sample_paths
+        self.sample_ids = sample_ids
+        self.cents = cents
+        self.offsets = offsets
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.mono = mono
+        # channels of the mix a fused mono sequence is downmixed from, None for sequences mixed as they are
+        self.downmix_from = downmix_from
+
+    @staticmethod
+    def create(sample_paths, sample_ids, cents, offsets, frame_rate, channels, sample_width, mono, downmix_from=None):
+        # a few bytes per shot: sample id, pitch in cents and the offset in frames
+        sample_ids = numpy.asarray(sample_ids, dtype=numpy.uint32)
+        cents = numpy.asarray(cents, dtype=numpy.int16)
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        return SequenceSchedule(list(sample_paths), sample_ids, cents, offsets, int(frame_rate), int(channels), int(sample_width), bool(mono), int(downmix_from) if downmix_from else None)
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def shot_path(self, index):
+        return self.sample_paths[self.sample_ids[index]]
+
+    def as_mono(self):
+        # the same shots as the schedule of the mono pass draws, rendered as the downmix of this schedule's mix
+        return SequenceSchedule.create(self.sample_paths, self.sample_ids, self.cents, self.offsets, self.frame_rate, 1, self.sample_width, True, self.channels)
+
+    def mixed_schedule(self):
+        # the schedule whose mix a downmixed sequence comes from
+        return SequenceSchedule.create(self.sample_paths, self.sample_ids, self.cents, self.offsets, self.frame_rate, self.downmix_from, self.sample_width, False)
+
+    def used_paths(self):
+        return list(map(lambda x: self.sample_paths[x], numpy.unique(self.sample_ids)))
+
+    def as_dict(self):
+        result = {
+            "sample_paths": self.sample_paths,
+            "sample_ids": self.sample_ids.tolist(),
+            "cents": self.cents.tolist(),
+            "offsets": self.offsets.tolist(),
+            "frame_rate": self.frame_rate,
+            "channels": self.channels,
+            "sample_width": self.sample_width,
+            "mono": self.mono
+        }
+        # only downmixed schedules carry it, so cache and manifest keys of every other schedule stay the same
+        if self.downmix_from:
+            result["downmix_from"] = self.downmix_from
+        return result
+
+    @staticmethod
+    def from_dict(src):
+        return SequenceSchedule.create(src["sample_paths"], src["sample_ids"], src["cents"], src["offsets"], src["frame_rate"], src["channels"], src["sample_width"], src["mono"], src.get("downmix_from"))
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.as_dict(), fp=fp)
+
+    @staticmethod
+    def load(path):
+        with open(path) as fp:
+            return SequenceSchedule.from_dict(json.load(fp))
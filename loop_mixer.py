@@ -0,0 +1,142 @@
+from pydub.utils import db_to_float, ratio_to_db
+from audio_bridge import SAMPLE_TYPES, segment_samples, samples_segment
+from wav_writer import WavWriter
+from render_profiler import stage
+import numpy, tempfile, os
+
+NORMALIZE_HEADROOM = 0.1
+STREAM_BLOCK_FRAMES = 1 << 16
+
+def sync_segment(segment, channels, frame_rate, sample_width):
+    return segment.set_channels(channels).set_frame_rate(frame_rate).set_sample_width(sample_width)
+
+def mono_segment(segment):
+    # the same downmix set_channels does for the mono renders
+    return segment.set_channels(1) if segment.channels > 1 else segment
+
+def downmix(mix):
+    return mix.mean(axis=1, keepdims=True)
+
+def accumulate_schedule(schedule, render_shot):
+    channels = schedule.channels
+    frame_rate = schedule.frame_rate
+    sample_width = schedule.sample_width
+    count = len(schedule)
+
+    # the last shot decides the length, every other shot is rendered right before it is added
+    last_shot = sync_segment(render_shot(count - 1), channels, frame_rate, sample_width)
+    total_frames = int(schedule.offsets[-1]) + int(last_shot.frame_count())
+    mix = numpy.zeros((total_frames, channels), dtype=numpy.float64)
+
+    for i in range(count):
+        shot = last_shot if i == count - 1 else sync_segment(render_shot(i), channels, frame_rate, sample_width)
+        start = int(schedule.offsets[i])
+        if start >= total_frames:
+            continue
+        samples = segment_samples(shot)
+        end = min(start + len(samples), total_frames)
+        mix[start:end] += samples[:end - start]
+
+    return mix
+
+def mix_schedule(schedule, render_shot, normalize_mix):
+    with stage("mix", {"shots": len(schedule)}):
+        mix = accumulate_schedule(schedule, render_shot)
+    return finish_mix(mix, schedule.frame_rate, schedule.sample_width, normalize_mix)
+
+def mix_schedule_fused(schedule, render_shot, normalize_mix):
+    # ((render, diff), (mono render, mono diff)), the mono mix is downmixed before normalizing so it gets its own peak
+    with stage("mix", {"shots": len(schedule)}):
+        mix = accumulate_schedule(schedule, render_shot)
+        mono = downmix(mix)
+    return (finish_mix(mix, schedule.frame_rate, schedule.sample_width, normalize_mix), finish_mix(mono, schedule.frame_rate, schedule.sample_width, normalize_mix))
+
+def mix_gain(peak, sample_width, normalize_mix):
+    max_possible = float(2 ** (sample_width * 8 - 1))
+
+    # the old overlay chain clipped on every add, so its peak never passed full scale
+    max_old = ratio_to_db(min(peak, max_possible), max_possible) if peak > 0 else -float("infinity")
+    gain = (max_possible * db_to_float(-NORMALIZE_HEADROOM)) / peak if normalize_mix and peak > 0 else None
+    return (gain, max_old)
+
+def finish_block(block, gain, sample_width):
+    max_possible = float(2 ** (sample_width * 8 - 1))
+    if gain is not None:
+        block *= gain
+    numpy.clip(block, -max_possible, max_possible - 1, out=block)
+    return block.astype(SAMPLE_TYPES[sample_width])
+
+def finish_mix(mix, frame_rate, sample_width, normalize_mix):
+    with stage("normalize mix"):
+        peak = float(numpy.abs(mix).max()) if mix.size else 0.0
+        gain, max_old = mix_gain(peak, sample_width, normalize_mix)
+
+        render = samples_segment(finish_block(mix, gain, sample_width), frame_rate, sample_width)
+        diff = abs(max_old - render.max_dBFS) if peak > 0 else 0.0
+
+    return (render, diff)
+
+def mix_diff(max_old, peak, max_new, sample_width):
+    # same as comparing with the max_dBFS of the rendered segment
+    return abs(max_old - ratio_to_db(max_new, float(2 ** (sample_width * 8 - 1)))) if peak > 0 else 0.0
+
+def stream_schedule(schedule, render_shot, normalize_mix, path, export_format=None, block_frames=STREAM_BLOCK_FRAMES, mono_path=None):
+    # same result as mix_schedule written to path, only the shots overlapping the current block are kept
+    # with a mono_path the downmixed mono mix is written as well, returns (diff, mono diff or None)
+    channels = schedule.channels
+    frame_rate = schedule.frame_rate
+    sample_width = schedule.sample_width
+    count = len(schedule)
+    outputs = [(path, channels)] + ([(mono_path, 1)] if mono_path else [])
+
+    # normalizing needs the peak of the whole mix, so the unscaled mix goes to a scratch file first
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as scratch:
+        with stage("mix", {"shots": count}):
+            last_shot = sync_segment(render_shot(count - 1), channels, frame_rate, sample_width)
+            total_frames = int(schedule.offsets[-1]) + int(last_shot.frame_count())
+
+            active = []
+            next_shot = 0
+            peaks = [0.0] * len(outputs)
+            for block_start in range(0, total_frames, block_frames):
+                block_end = min(block_start + block_frames, total_frames)
+                while next_shot < count and int(schedule.offsets[next_shot]) < block_end:
+                    shot = last_shot if next_shot == count - 1 else sync_segment(render_shot(next_shot), channels, frame_rate, sample_width)
+                    active.append((int(schedule.offsets[next_shot]), segment_samples(shot)))
+                    next_shot += 1
+
+                block = numpy.zeros((block_end - block_start, channels), dtype=numpy.float64)
+                for start, samples in active:
+                    first = max(start, block_start)
+                    end = min(start + len(samples), block_end)
+                    if end > first:
+                        block[first - block_start:end - block_start] += samples[first - start:end - start]
+                active = list(filter(lambda x: x[0] + len(x[1]) > block_end, active))
+
+                blocks = [block, downmix(block)][:len(outputs)]
+                for i in range(len(blocks)):
+                    if blocks[i].size:
+                        peaks[i] = max(peaks[i], float(numpy.abs(blocks[i]).max()))
+                    scratch.write(blocks[i])
+
+        # the second pass normalizes and writes block by block, so both stages cover it
+        with stage("normalize mix"), stage("write", {"path": path}):
+            gains = list(map(lambda x: mix_gain(x, sample_width, normalize_mix), peaks))
+            max_new = [0] * len(outputs)
+            scratch.seek(0)
+            writers = list(map(lambda x: WavWriter.create(x[0], frame_rate, x[1], sample_width, export_format), outputs))
+            try:
+                for block_start in range(0, total_frames, block_frames):
+                    frames = min(block_frames, total_frames - block_start)
+                    for i in range(len(outputs)):
+                        block_channels = outputs[i][1]
+                        block = finish_block(numpy.fromfile(scratch, dtype=numpy.float64, count=frames * block_channels).reshape(-1, block_channels), gains[i][0], sample_width)
+                        if block.size:
+                            max_new[i] = max(max_new[i], int(numpy.abs(block.astype(numpy.int64)).max()))
+                        writers[i].write(block)
+            finally:
+                for writer in writers:
+                    writer.close()
+
+    diffs = [mix_diff(gains[i][1], peaks[i], max_new[i], sample_width) for i in range(len(outputs))]
+    return (diffs[0], diffs[1] if mono_path else None)
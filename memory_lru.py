@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+class MemoryBoundedLRU:
+    def __init__(self, max_bytes, sizeof, on_evict):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+
+    @staticmethod
+    def create(max_bytes, sizeof=len, on_evict=None):
+        return MemoryBoundedLRU(max(max_bytes, 0), sizeof, on_evict)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        # values larger than the whole budget are not kept at all
+        if size > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.total_bytes = self.total_bytes + size
+        self.evict(self.max_bytes)
+
+    def pop(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.total_bytes = self.total_bytes - self.sizes.pop(key)
+        return self.entries.pop(key)
+
+    def evict(self, max_bytes):
+        while self.total_bytes > max_bytes and self.entries:
+            key = next(iter(self.entries))
+            value = self.pop(key)
+            if self.on_evict:
+                self.on_evict(key, value)
+
+    def resize(self, max_bytes):
+        self.max_bytes = max(max_bytes, 0)
+        self.evict(self.max_bytes)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.total_bytes = 0
@@ -0,0 +1,105 @@
+from concurrent.futures import ProcessPoolExecutor
+from weapon_fire_sample import WeaponFireSample
+from shared_sources import attach_sources
+from audio_bridge import detach_segment
+from loop_mixer import mono_segment
+from render_profiler import stage
+import render_profiler
+
+TASK_DEFAULT = "default"
+TASK_TAIL = "tail"
+TASK_BURST = "burst"
+TASK_LOOP = "loop"
+worker_generator = None
+
+def export_tasks(loop_settings, sample_count, mono, burst_schedules, loop_schedules):
+    variations = loop_settings.variations
+
+    # (kind, mono, sample index, variation, schedule), tails draw from the per-variation schedule streams
+    tasks = [(TASK_DEFAULT, mono, i, 0, None) for i in range(sample_count)]
+
+    for i in range(sample_count):
+        for j in range(max(variations, 1)):
+            tasks.append((TASK_TAIL, mono, i, j, None))
+
+    for i in range(len(burst_schedules)):
+        tasks.append((TASK_BURST, mono, 0, i, burst_schedules[i]))
+
+    for i in range(len(loop_schedules)):
+        tasks.append((TASK_LOOP, mono, 0, i, loop_schedules[i]))
+
+    return tasks
+
+def init_worker(loop_settings, target_format, export_inputs, sample_props, source_descriptors, engine_name, engine_quality, render_cache, profile):
+    global worker_generator
+    from weapon_fire_loop_generator import WeaponFireLoopGenerator
+
+    # workers profile into their own profiler and send the events back with every result
+    if profile:
+        render_profiler.enable()
+
+    with stage("attach sources"):
+        sources = attach_sources(source_descriptors)
+
+    worker_generator = WeaponFireLoopGenerator.create(lambda text: None)
+    worker_generator.set_current_loop_settings(loop_settings)
+    # the sources arrive conformed, the format would otherwise fall back to nothing and end up in every render cache key
+    worker_generator.sample_manager.set_format(*target_format)
+    # render cache keys use the inputs and source hashes the parent collected for the export
+    worker_generator.export_inputs = export_inputs
+    worker_generator.print_log = False
+    worker_generator.set_render_engine(engine_name, engine_quality)
+    if render_cache:
+        worker_generator.set_render_cache(*render_cache)
+    for props in sample_props:
+        sample = WeaponFireSample.from_dict(props)
+        sample.source_sound = sources[sample.path]
+        worker_generator.sample_manager.update_sample(sample)
+
+def detach_result(result):
+    # rendered segments may be views on numpy arrays, pickle them as plain bytes
+    if isinstance(result, tuple):
+        return tuple(map(detach_result, result))
+    # streamed loops are written by the worker and come back without audio
+    if result is None or isinstance(result, float):
+        return result
+    return detach_segment(result)
+
+def run_task(task):
+    with stage("task", {"kind": task[0], "mono": task[1], "index": task[2], "variation": task[3]}):
+        result = detach_result(worker_generator.render_task(task))
+    # (result, profiled events or None, metrics recorded for the task)
+    return (result, render_profiler.active.take_events() if render_profiler.active else None, worker_generator.metrics.take())
+
+def render_tasks(generator, tasks, workers):
+    sample_props = list(map(lambda x: x.as_dict(), generator.sample_manager.get_samples_list()))
+    engine = generator.render_engine
+    # workers share the render cache directory of the generator
+    render_cache = (generator.render_cache.path, generator.render_cache.max_bytes) if generator.render_cache else None
+
+    # workers map the decoded sources from shared memory instead of unpickling them
+    with generator.sample_manager.share_sources() as shared:
+        initargs = (generator.current_loop_settings, generator.sample_manager.target_format(), generator.export_inputs, sample_props, shared.descriptors, engine.name, engine.quality, render_cache, render_profiler.active is not None)
+        with stage("render tasks", {"tasks": len(tasks), "workers": workers}), ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+            results = list(executor.map(run_task, tasks))
+
+    for _, events, metrics in results:
+        if events and render_profiler.active:
+            render_profiler.active.merge(events)
+        generator.metrics.merge(metrics)
+    return list(map(lambda x: x[0], results))
+
+def split_results(tasks, results):
+    split = {TASK_DEFAULT: [], TASK_TAIL: [], TASK_BURST: [], TASK_LOOP: []}
+    for task, result in zip(tasks, results):
+        split[task[0]].append(result)
+    return split
+
+def split_fused(split):
+    # stereo and mono results of fused tasks, defaults and tails are downmixed here
+    stereo = dict(split)
+    mono = {TASK_DEFAULT: list(map(mono_segment, split[TASK_DEFAULT])), TASK_TAIL: list(map(mono_segment, split[TASK_TAIL]))}
+    for kind in [TASK_BURST, TASK_LOOP]:
+        stereo[kind] = list(map(lambda x: x[0], split[kind]))
+        mono[kind] = list(map(lambda x: x[1], split[kind]))
+    return (stereo, mono)
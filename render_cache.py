@@ -0,0 +1,116 @@
+from wav_reader import read_wav, UnsupportedWav
+from wav_writer import WavWriter
+from audio_bridge import segment_samples, segment_nbytes
+from memory_lru import MemoryBoundedLRU
+import os, time, tempfile
+
+DEFAULT_RENDER_CACHE_PATH = os.path.join(os.getcwd(), "render_cache")
+DEFAULT_RENDER_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_RENDER_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+ENTRY_EXTENSION = ".wav"
+TEMP_EXTENSION = ".tmp"
+# evicting goes a bit below the budget, so not every put has to scan the directory
+EVICT_RATIO = 0.9
+# temp files of writers that died, anything younger may still be written by another process
+STALE_TEMP_SECONDS = 3600
+
+class DiskRenderCache:
+    def __init__(self, path, max_bytes, memory):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory = memory
+        self.total_bytes = None
+
+    @staticmethod
+    def create(path=DEFAULT_RENDER_CACHE_PATH, max_bytes=DEFAULT_RENDER_CACHE_BYTES, memory_bytes=DEFAULT_RENDER_CACHE_MEMORY_BYTES):
+        os.makedirs(path, exist_ok=True)
+        return DiskRenderCache(path, max(max_bytes, 0), MemoryBoundedLRU.create(memory_bytes, lambda x: segment_nbytes(x[0])))
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + ENTRY_EXTENSION)
+
+    def get(self, key):
+        # (segment, metadata) or None
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+
+        path = self.entry_path(key)
+        try:
+            segment, header = read_wav(path, True)
+            # the mtime is the recency eviction goes by
+            os.utime(path)
+        except (OSError, UnsupportedWav):
+            return None
+
+        entry = (segment, header.metadata or {})
+        self.memory.put(key, entry)
+        return entry
+
+    def put(self, key, segment, metadata=None):
+        # written to a temp file and renamed, concurrent readers see the whole entry or none
+        path = self.entry_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=TEMP_EXTENSION, dir=directory)
+        os.close(fd)
+        try:
+            with WavWriter.create(temp_path, segment.frame_rate, segment.channels, segment.sample_width, metadata=metadata) as writer:
+                writer.write(segment_samples(segment))
+            os.replace(temp_path, path)
+        except OSError:
+            # another process holds the same entry open, it has the same content anyway
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.memory.put(key, (segment, metadata or {}))
+        self.added(os.path.getsize(path))
+
+    def entries(self):
+        # (mtime, size, path) of every entry, stale temp files are removed on the way
+        entries = []
+        now = time.time()
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(TEMP_EXTENSION) and now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        os.remove(path)
+                    elif name.endswith(ENTRY_EXTENSION):
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    continue
+        return entries
+
+    def added(self, size):
+        if self.total_bytes is None:
+            self.total_bytes = sum(map(lambda x: x[1], self.entries()))
+        else:
+            self.total_bytes = self.total_bytes + size
+        if self.total_bytes > self.max_bytes:
+            self.evict(int(self.max_bytes * EVICT_RATIO))
+
+    def evict(self, max_bytes):
+        # other processes share the directory, so the sizes are scanned again instead of trusting the running total
+        entries = sorted(self.entries())
+        total = sum(map(lambda x: x[1], entries))
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # still open by another process on windows, it goes with a later eviction
+                continue
+            total = total - size
+        self.total_bytes = total
+
+    def resize(self, max_bytes):
+        self.max_bytes = max(max_bytes, 0)
+        self.evict(self.max_bytes)
+
+    def clear(self):
+        self.memory.clear()
+        self.evict(0)
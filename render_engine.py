@@ -0,0 +1,192 @@
+from pydub.effects import normalize
+from pydub.utils import db_to_float
+from resampler import resample, RESAMPLE_FAST, RESAMPLE_QUALITIES
+from audio_bridge import SAMPLE_TYPES, segment_samples, samples_segment
+from silence_trim import trim_silence, nonsilent_ranges, slice_ms
+from fade_envelope import fade_segment, apply_fade, FADE_LINEAR
+from render_profiler import stage
+import numpy, weakref
+
+STRIP_SILENCE_THRESHOLD = -72
+MAX_SILENCE_LENGTH = 111
+STRIP_SILENCE_PADDING = 100
+SILENCE = -120
+
+RENDER_DEFAULT = "default"
+RENDER_TAIL = "tail"
+RENDER_LOOPED = "looped"
+
+# part of every render cache key, bump it whenever a change alters rendered audio
+RENDER_VERSION = 2
+
+class PydubRenderEngine:
+    name = "pydub"
+    quality = RESAMPLE_FAST
+
+    @staticmethod
+    def create():
+        return PydubRenderEngine()
+
+    def prepare(self, sample, kind, mono):
+        with stage("normalize"):
+            render = normalize(sample.source_sound, abs(sample.headroom))
+
+        if mono:
+            with stage("downmix"):
+                render = render.set_channels(1)
+
+        with stage("fade"):
+            if kind == RENDER_LOOPED:
+                if sample.loop_fadeout_start_ms > 0 and sample.loop_fadeout_length_ms > 0:
+                    render = fade_segment(render, to_gain=SILENCE, start=sample.loop_fadeout_start_ms, duration=sample.loop_fadeout_length_ms, curve=sample.fade_curve)
+            elif kind == RENDER_TAIL:
+                if sample.tail_offset_ms > 0 and sample.tail_fadein_ms > 0:
+                    offset = -numpy.clip(len(render) - sample.tail_offset_ms, 0, len(render))
+                    render = render[offset:]
+                    render = fade_segment(render, from_gain=SILENCE, start=0, duration=sample.tail_fadein_ms, curve=sample.fade_curve)
+
+        with stage("trim"):
+            return self.strip_silence(render)
+
+    def strip_silence(self, render):
+        # same result as strip_silence(render, 111, -72), the silent ranges come from the vectorized envelope
+        samples = segment_samples(render)
+        ranges = nonsilent_ranges(samples, render.frame_rate, render.max_possible_amplitude, MAX_SILENCE_LENGTH, STRIP_SILENCE_THRESHOLD, STRIP_SILENCE_PADDING)
+        if len(ranges) < 2:
+            trimmed = slice_ms(samples, render.frame_rate, *ranges[0]) if ranges else samples[:0]
+            return samples_segment(trimmed, render.frame_rate, render.sample_width)
+
+        # gaps inside the shot are rare, the chunks are crossfaded by pydub so they stay bit exact
+        render = samples_segment(samples, render.frame_rate, render.sample_width)
+        stripped = render[ranges[0][0]:ranges[0][1]]
+        for start, end in ranges[1:]:
+            stripped = stripped.append(render[start:end], crossfade=STRIP_SILENCE_PADDING / 2)
+        return stripped
+
+    def pitch(self, audio, cents):
+        octaves = cents / 1200.0
+        old_sample_rate = audio.frame_rate
+        new_sample_rate = int(old_sample_rate * (2.0 ** octaves))
+
+        with stage("pitch"):
+            pitched = audio._spawn(audio.raw_data, overrides={'frame_rate': new_sample_rate})
+            pitched = pitched.set_frame_rate(old_sample_rate)
+        return pitched
+
+    def to_segment(self, audio):
+        return audio
+
+class NumpyBuffer:
+    def __init__(self, samples, frame_rate, sample_width):
+        self.samples = samples
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+
+    def __len__(self):
+        return round(1000 * len(self.samples) / self.frame_rate)
+
+    def frame_count(self, ms):
+        return ms * (self.frame_rate / 1000.0)
+
+class NumpyRenderEngine:
+    name = "numpy"
+
+    def __init__(self, quality):
+        self.decoded = {}
+        self.quality = quality
+
+    @staticmethod
+    def create(quality=RESAMPLE_FAST):
+        if quality not in RESAMPLE_QUALITIES:
+            raise ValueError("Unknown resample quality: " + str(quality))
+        return NumpyRenderEngine(quality)
+
+    @staticmethod
+    def max_possible_amplitude(sample_width):
+        return float(2 ** (sample_width * 8 - 1))
+
+    def decode(self, sample):
+        source = sample.source_sound
+        samples = self.decoded.get(id(source))
+        if samples is not None:
+            return samples
+
+        with stage("decode samples"):
+            samples = segment_samples(source).astype(numpy.float32)
+            samples *= 1.0 / NumpyRenderEngine.max_possible_amplitude(source.sample_width)
+
+        # keyed by the source object and dropped together with it, so evicted or reloaded sources are not pinned
+        self.decoded[id(source)] = samples
+        weakref.finalize(source, self.decoded.pop, id(source), None)
+        return samples
+
+    def prepare(self, sample, kind, mono):
+        source = sample.source_sound
+        decoded = self.decode(sample)
+        with stage("normalize"):
+            render = NumpyBuffer(self.normalize(decoded, abs(sample.headroom)), source.frame_rate, source.sample_width)
+
+        if mono and render.samples.shape[1] > 1:
+            with stage("downmix"):
+                render.samples = render.samples.mean(axis=1, dtype=numpy.float32, keepdims=True)
+
+        with stage("fade"):
+            if kind == RENDER_LOOPED:
+                if sample.loop_fadeout_start_ms > 0 and sample.loop_fadeout_length_ms > 0:
+                    self.fade(render, to_gain=SILENCE, start=sample.loop_fadeout_start_ms, duration=sample.loop_fadeout_length_ms, curve=sample.fade_curve)
+            elif kind == RENDER_TAIL:
+                if sample.tail_offset_ms > 0 and sample.tail_fadein_ms > 0:
+                    # same quirk as the pydub path: an offset beyond the sample keeps the whole sample
+                    len_render = len(render)
+                    offset = len_render - numpy.clip(len_render - sample.tail_offset_ms, 0, len_render)
+                    if offset < len_render:
+                        render.samples = render.samples[int(render.frame_count(offset)):]
+                    self.fade(render, from_gain=SILENCE, start=0, duration=sample.tail_fadein_ms, curve=sample.fade_curve)
+
+        with stage("trim"):
+            max_possible = NumpyRenderEngine.max_possible_amplitude(render.sample_width)
+            render.samples = trim_silence(render.samples, render.frame_rate, max_possible, MAX_SILENCE_LENGTH, STRIP_SILENCE_THRESHOLD, STRIP_SILENCE_PADDING, max_possible)
+        return render
+
+    def normalize(self, samples, headroom):
+        peak = float(numpy.abs(samples).max()) if len(samples) else 0.0
+        if peak == 0:
+            return samples.copy()
+        normalized = samples * numpy.float32(db_to_float(-headroom) / peak)
+        return normalized
+
+    def fade(self, render, to_gain=0, from_gain=0, start=0, duration=0, curve=FADE_LINEAR):
+        start = min(len(render), start)
+        apply_fade(render.samples, render.frame_rate, start, duration, from_gain, to_gain, curve)
+
+    def pitch(self, render, cents):
+        octaves = cents / 1200.0
+        old_sample_rate = render.frame_rate
+        new_sample_rate = int(old_sample_rate * (2.0 ** octaves))
+
+        if new_sample_rate == old_sample_rate or len(render.samples) == 0:
+            return render
+
+        # fast quality interpolates at the same positions audioop.ratecv uses
+        with stage("pitch"):
+            pitched = resample(render.samples, new_sample_rate, old_sample_rate, self.quality)
+        return NumpyBuffer(pitched, old_sample_rate, render.sample_width)
+
+    def to_segment(self, render):
+        max_possible = NumpyRenderEngine.max_possible_amplitude(render.sample_width)
+        # float32 cannot hold the int32 range exactly
+        scaled = render.samples * (numpy.float64(max_possible) if render.sample_width == 4 else numpy.float32(max_possible))
+        numpy.clip(scaled, -max_possible, max_possible - 1, out=scaled)
+        return samples_segment(scaled.astype(SAMPLE_TYPES[render.sample_width]), render.frame_rate, render.sample_width)
+
+RENDER_ENGINES = {
+    PydubRenderEngine.name: PydubRenderEngine,
+    NumpyRenderEngine.name: NumpyRenderEngine,
+}
+
+def create_render_engine(name, quality=None):
+    if name not in RENDER_ENGINES:
+        raise ValueError("Unknown render engine: " + str(name))
+    if name == NumpyRenderEngine.name and quality:
+        return NumpyRenderEngine.create(quality)
+    return RENDER_ENGINES[name].create()
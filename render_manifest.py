@@ -0,0 +1,71 @@
+import hashlib, json, os
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+def inputs_key(inputs):
+    # numpy scalars end up in render params, item() turns them into plain numbers
+    text = json.dumps(inputs, sort_keys=True, default=lambda x: x.item())
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+class RenderManifest:
+    def __init__(self, path, outputs):
+        self.path = path
+        self.outputs = outputs
+
+    @staticmethod
+    def create(path):
+        return RenderManifest(path, {})
+
+    @staticmethod
+    def load(path):
+        # a missing, broken or outdated manifest just renders everything again
+        try:
+            with open(os.path.join(path, MANIFEST_NAME)) as fp:
+                src = json.load(fp)
+        except (OSError, ValueError):
+            return RenderManifest.create(path)
+        if not isinstance(src, dict) or src.get("version") != MANIFEST_VERSION:
+            return RenderManifest.create(path)
+        return RenderManifest.from_dict(path, src)
+
+    def as_dict(self):
+        return {"version": MANIFEST_VERSION, "outputs": self.outputs}
+
+    @staticmethod
+    def from_dict(path, src):
+        return RenderManifest(path, dict(src["outputs"]))
+
+    def is_current(self, name, key):
+        entry = self.outputs.get(name)
+        if entry is None or entry["key"] != key:
+            return False
+        return all(map(lambda x: os.path.exists(os.path.join(self.path, x)), entry["files"]))
+
+    def diff(self, name):
+        return self.outputs[name]["diff"]
+
+    def record(self, name, key, files, diff=None):
+        self.outputs[name] = {"key": key, "files": files, "diff": diff}
+
+    def invalidate(self, names):
+        # dropped before their files are overwritten, an interrupted export never leaves a stale entry behind
+        for name in names:
+            self.outputs.pop(name, None)
+        self.save()
+
+    def remove_orphans(self, names):
+        removed = []
+        for name in list(filter(lambda x: x not in names, self.outputs)):
+            for file_name in self.outputs.pop(name)["files"]:
+                file_path = os.path.join(self.path, file_name)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    removed.append(file_path)
+        return removed
+
+    def save(self):
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", 'w') as fp:
+            json.dump(self.as_dict(), fp=fp, indent=4, sort_keys=True)
+        os.replace(manifest_path + ".tmp", manifest_path)
@@ -0,0 +1,154 @@
+import bisect, math, os, threading
+
+METRICS_PREFIX = "weapon_fire_"
+# upper bounds in seconds, renders of a single shot are in the low milliseconds, long loops take seconds
+RENDER_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name: (type, help), everything the generator and sample manager record
+METRICS = {
+    "shots_rendered_total": (COUNTER, "Samples rendered by kind (default, tail, looped shot), render cache hits included"),
+    "samples_decoded_total": (COUNTER, "Source files decoded, by the numpy wav reader or by pydub"),
+    "render_cache_hits_total": (COUNTER, "Disk render cache lookups that found an entry"),
+    "render_cache_misses_total": (COUNTER, "Disk render cache lookups that had to render"),
+    "memory_cache_hits_total": (COUNTER, "In memory cache lookups that found an entry: prepared (pre pitch renders), pitch (pitched variants), source (lazily decoded sources)"),
+    "memory_cache_misses_total": (COUNTER, "In memory cache lookups that had to render or decode"),
+    "memory_cache_evictions_total": (COUNTER, "Entries dropped from the byte bounded pitch variant and source caches"),
+    "bytes_read_total": (COUNTER, "Bytes read from sources, for source hashes and from the render cache"),
+    "bytes_written_total": (COUNTER, "Bytes written to exports and to the render cache"),
+    "render_seconds": (HISTOGRAM, "Render time per output, shots of sequences are included in their sequence"),
+    "exports_total": (COUNTER, "Finished exports"),
+    "last_export_seconds": (GAUGE, "Duration of the last export"),
+    "last_export_bytes_per_second": (GAUGE, "Bytes written per second by the last export"),
+}
+
+def label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+def format_labels(key):
+    if len(key) == 0:
+        return ""
+    return "{" + ",".join(map(lambda x: x[0] + '="' + str(x[1]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"', key)) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def dump_values(buckets, values):
+    return {"buckets": list(buckets), "values": list(map(lambda x: [x[0][0], dict(x[0][1]), x[1]], values.items()))}
+
+class RenderMetrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.values = {}
+        # decode threads record into the same metrics
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create(buckets=RENDER_TIME_BUCKETS):
+        return RenderMetrics(tuple(sorted(buckets)))
+
+    def check(self, name, kind):
+        if name not in METRICS or METRICS[name][0] != kind:
+            raise ValueError("Unknown " + kind + ": " + str(name))
+
+    def inc(self, name, value=1, labels=None):
+        self.check(name, COUNTER)
+        key = (name, label_key(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        self.check(name, GAUGE)
+        with self.lock:
+            self.values[(name, label_key(labels))] = value
+
+    def observe(self, name, value, labels=None):
+        # histograms keep (count per bucket, sum, count), the last bucket is +Inf
+        self.check(name, HISTOGRAM)
+        key = (name, label_key(labels))
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0, 0))
+            counts = list(counts)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def value(self, name, labels=None):
+        # counters and gauges as numbers, histograms as (count per bucket, sum, count), missing ones are 0
+        return self.values.get((name, label_key(labels)), 0)
+
+    def total(self, name):
+        # counter summed over all labels
+        return sum(map(lambda x: x[1], filter(lambda x: x[0][0] == name, self.values.items())))
+
+    def as_dict(self):
+        with self.lock:
+            return dump_values(self.buckets, self.values)
+
+    @staticmethod
+    def from_dict(src):
+        metrics = RenderMetrics.create(src["buckets"])
+        metrics.merge(src)
+        return metrics
+
+    def take(self):
+        # export workers send what they recorded with every result and start over
+        with self.lock:
+            values = self.values
+            self.values = {}
+        return dump_values(self.buckets, values)
+
+    def merge(self, src):
+        # counters and histograms add up, gauges take the merged value
+        for name, labels, value in src["values"]:
+            kind = METRICS[name][0]
+            if kind == COUNTER:
+                self.inc(name, value, labels)
+            elif kind == GAUGE:
+                self.set(name, value, labels)
+            else:
+                key = (name, label_key(labels))
+                with self.lock:
+                    counts, total, count = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0, 0))
+                    self.values[key] = (list(map(lambda x: x[0] + x[1], zip(counts, value[0]))), total + value[1], count + value[2])
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def prometheus_text(self, labels=None):
+        # text exposition format, labels are added to every sample (e.g. the project)
+        extra = label_key(labels)
+        with self.lock:
+            values = dict(self.values)
+        lines = []
+        for name in METRICS:
+            entries = sorted(filter(lambda x: x[0][0] == name, values.items()), key=lambda x: x[0][1])
+            if len(entries) == 0:
+                continue
+            kind, text = METRICS[name]
+            full_name = METRICS_PREFIX + name
+            lines.append("# HELP " + full_name + " " + text)
+            lines.append("# TYPE " + full_name + " " + kind)
+            for (_, key), value in entries:
+                if kind != HISTOGRAM:
+                    lines.append(full_name + format_labels(extra + key) + " " + format_value(value))
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (math.inf,), counts):
+                    cumulative = cumulative + bucket
+                    lines.append(full_name + "_bucket" + format_labels(extra + key + (("le", format_value(bound)),)) + " " + str(cumulative))
+                lines.append(full_name + "_sum" + format_labels(extra + key) + " " + format_value(float(total)))
+                lines.append(full_name + "_count" + format_labels(extra + key) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, labels=None):
+        # the textfile collector may read at any time, so the file is replaced as a whole
+        with open(path + ".tmp", 'w') as fp:
+            fp.write(self.prometheus_text(labels))
+        os.replace(path + ".tmp", path)
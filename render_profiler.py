@@ -0,0 +1,99 @@
+import json, os, threading, time
+
+# the profiler stages report to, None keeps every stage a shared no-op
+active = None
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_STAGE = NullStage()
+
+class ProfiledStage:
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+def stage(name, args=None):
+    if active is None:
+        return NULL_STAGE
+    return active.stage(name, args)
+
+def enable():
+    global active
+    if active is None:
+        active = RenderProfiler.create()
+    return active
+
+def disable():
+    global active
+    profiler = active
+    active = None
+    return profiler
+
+class RenderProfiler:
+    def __init__(self, origin):
+        self.origin = origin
+        self.events = []
+
+    @staticmethod
+    def create():
+        return RenderProfiler(time.perf_counter_ns())
+
+    def stage(self, name, args=None):
+        return ProfiledStage(self, name, args)
+
+    def record(self, name, start, end, args=None):
+        # appends are atomic, decode threads record into the same list
+        self.events.append((name, start, end, os.getpid(), threading.get_ident(), args))
+
+    def take_events(self):
+        # export workers send their events back with each result
+        events = self.events
+        self.events = []
+        return events
+
+    def merge(self, events):
+        self.events.extend(events)
+
+    def trace_events(self):
+        # chrome trace complete events, times in microseconds since the profiler started
+        return list(map(lambda x: {"name": x[0], "cat": "render", "ph": "X", "ts": (x[1] - self.origin) / 1000.0, "dur": (x[2] - x[1]) / 1000.0, "pid": x[3], "tid": x[4], "args": x[5] or {}}, self.events))
+
+    def save_trace(self, path):
+        with open(path, 'w') as fp:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, fp=fp)
+
+    def summary(self):
+        # (name, count, total ms, mean ms, max ms) by total time, nested stages count towards their parents as well
+        stages = {}
+        for name, start, end, _, _, _ in self.events:
+            count, total, longest = stages.get(name, (0, 0, 0))
+            stages[name] = (count + 1, total + end - start, max(longest, end - start))
+        rows = list(map(lambda x: (x[0], x[1][0], x[1][1] / 1e6, x[1][1] / 1e6 / x[1][0], x[1][2] / 1e6), stages.items()))
+        return sorted(rows, key=lambda x: -x[2])
+
+    def wall_ms(self):
+        if len(self.events) == 0:
+            return 0.0
+        return (max(map(lambda x: x[2], self.events)) - min(map(lambda x: x[1], self.events))) / 1e6
+
+    def summary_table(self):
+        wall = self.wall_ms()
+        lines = ["{:<20} {:>8} {:>12} {:>10} {:>10} {:>7}".format("stage", "count", "total ms", "mean ms", "max ms", "wall %")]
+        for name, count, total, mean, longest in self.summary():
+            lines.append("{:<20} {:>8} {:>12.2f} {:>10.3f} {:>10.3f} {:>7.1f}".format(name, count, total, mean, longest, 100.0 * total / wall if wall > 0 else 0.0))
+        return "\n".join(lines)
@@ -0,0 +1,77 @@
+import numpy
+
+RESAMPLE_FAST = "fast"
+RESAMPLE_HIGH = "high"
+RESAMPLE_QUALITIES = [RESAMPLE_FAST, RESAMPLE_HIGH]
+
+SINC_TAPS = 32
+SINC_PHASES = 256
+KAISER_BETA = 8.6
+
+kernel_tables = {}
+
+def output_frame_count(frame_count, in_rate, out_rate):
+    # same length audioop.ratecv produces
+    if frame_count == 0:
+        return 0
+    return int((frame_count - 1) * out_rate // in_rate) + 1
+
+def kernel_table(in_rate, out_rate, taps=SINC_TAPS, phases=SINC_PHASES):
+    cutoff = min(1.0, out_rate / in_rate)
+    key = (round(cutoff, 9), taps, phases)
+    table = kernel_tables.get(key)
+    if table is not None:
+        return table
+
+    half = taps // 2
+    offsets = numpy.arange(-half + 1, half + 1, dtype=numpy.float64)
+    fractions = numpy.arange(phases + 1, dtype=numpy.float64) / phases
+    x = offsets[None, :] - fractions[:, None]
+
+    window = numpy.i0(KAISER_BETA * numpy.sqrt(numpy.clip(1.0 - (x / half) ** 2, 0.0, 1.0))) / numpy.i0(KAISER_BETA)
+    table = cutoff * numpy.sinc(cutoff * x) * window
+    table /= table.sum(axis=1, keepdims=True)
+
+    table = table.astype(numpy.float32)
+    kernel_tables[key] = table
+    return table
+
+def resample_linear(samples, in_rate, out_rate):
+    count = output_frame_count(len(samples), in_rate, out_rate)
+    positions = numpy.arange(count, dtype=numpy.float64) * (in_rate / out_rate)
+    index = numpy.minimum(positions.astype(numpy.int64), len(samples) - 1)
+    following = numpy.minimum(index + 1, len(samples) - 1)
+    frac = (positions - index).astype(numpy.float32)[:, None]
+
+    resampled = samples[following] - samples[index]
+    resampled *= frac
+    resampled += samples[index]
+    return resampled
+
+def resample_sinc(samples, in_rate, out_rate):
+    table = kernel_table(in_rate, out_rate)
+    phases = len(table) - 1
+    taps = table.shape[1]
+    half = taps // 2
+
+    count = output_frame_count(len(samples), in_rate, out_rate)
+    positions = numpy.arange(count, dtype=numpy.float64) * (in_rate / out_rate)
+    base = positions.astype(numpy.int64)
+    phase = numpy.round((positions - base) * phases).astype(numpy.int64)
+
+    # zero padding on both sides keeps every tap index valid
+    padded = numpy.zeros((len(samples) + taps, samples.shape[1]), dtype=numpy.float32)
+    padded[half:half + len(samples)] = samples
+
+    resampled = numpy.zeros((count, samples.shape[1]), dtype=numpy.float32)
+    # one pass per tap, every channel and output frame at once
+    for tap in range(taps):
+        resampled += padded[base + tap + 1] * table[phase, tap][:, None]
+    return resampled
+
+def resample(samples, in_rate, out_rate, quality=RESAMPLE_FAST):
+    if in_rate == out_rate or len(samples) == 0:
+        return samples
+    if quality == RESAMPLE_HIGH:
+        return resample_sinc(samples, in_rate, out_rate)
+    return resample_linear(samples, in_rate, out_rate)
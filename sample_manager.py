@@ -1,37 +1,289 @@
 from pydub import AudioSegment
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os, io, hashlib, bisect
 from weapon_fire_sample import WeaponFireSample
-from pydub.playback import play
+from shared_sources import SharedSourceBlocks
+from memory_lru import MemoryBoundedLRU
+from audio_bridge import segment_nbytes
+from loop_mixer import sync_segment
+from wav_reader import read_wav_data, read_format, UnsupportedWav
+from render_profiler import stage
+from render_metrics import RenderMetrics
+
+DEFAULT_LOAD_WORKERS = min(8, os.cpu_count() or 1)
+
+class SourceChanged(ValueError):
+    pass
+
+def file_stats(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def read_file(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
 
 class SampleManager:
-    def __init__(self):
+    def __init__(self, metrics):
+        self.metrics = metrics
         self.samples = {}
+        self.pitch_cache_bytes = None
+        self.frame_rate = None
+        self.sample_width = None
+        self.channels = None
+        self.source_formats = {}
+        self.source_stats = {}
+        self.source_paths = {}
+        self.sample_order = []
+        self.order_entries = {}
+        self.source_cache = None
 
     @staticmethod
-    def create():
-        return SampleManager()
+    def create(metrics=None):
+        return SampleManager(metrics or RenderMetrics.create())
+
+    def decode(self, path):
+        with stage("decode", {"path": path}):
+            return self.decode_file(path)
+
+    def decode_file(self, path):
+        # read once and parsed in memory, sources never stay mapped onto files that may be edited or replaced while loaded
+        # the stats are taken first, a file replaced while it is read shows up as changed afterwards
+        stats = file_stats(path)
+        data = read_file(path)
+        try:
+            source = read_wav_data(data, path)
+            method = "numpy"
+        except UnsupportedWav:
+            source = AudioSegment.from_file(io.BytesIO(data), format="wav")
+            method = "pydub"
+        self.source_stats[path] = (stats[0], stats[1], content_hash(data))
+        self.metrics.inc("samples_decoded_total", labels={"method": method})
+        self.metrics.inc("bytes_read_total", len(data), {"source": "sample"})
+        self.source_formats[path] = (source.frame_rate, source.sample_width, source.channels)
+        return source
+
+    def source_changed(self, path):
+        # unchanged while size and mtime match, or when only the mtime moved but the content hash did not
+        known = self.source_stats.get(path)
+        stats = file_stats(path)
+        if known and known[:2] == stats:
+            return False
 
-    def load_files(self, paths):
-        for samplePath in paths:
-            currentImport = AudioSegment.from_file(samplePath, format="wav")
-            sample = WeaponFireSample.create(currentImport, samplePath, os.path.basename(samplePath))
-            self.samples[samplePath] = sample
-        self.samples = dict(sorted(self.samples.items(), key=lambda x: (x[1].name, x[1].path)))    
+        # sources invalidated before their next decode have no hash yet
+        if known and known[0] == stats[0] and known[2] is not None:
+            self.metrics.inc("bytes_read_total", stats[0], {"source": "hash"})
+            if known[2] == content_hash(read_file(path)):
+                self.source_stats[path] = (stats[0], stats[1], known[2])
+                return False
+        return True
+
+    def source_hash(self, path):
+        # hash of the audio that is loaded, renders keyed by a file that changed since would be recorded under the wrong content
+        if self.source_changed(path):
+            raise SourceChanged("Sample changed since it was loaded, reload samples first: " + path)
+        if self.source_stats[path][2] is None:
+            # invalidated sources are decoded on their next render, which records the hash
+            self.samples[path].source_sound
+        return self.source_stats[path][2]
+
+    def decode_changed(self, path):
+        return self.decode(path) if self.source_changed(path) else None
+
+    def load_files(self, paths, progress=None, workers=DEFAULT_LOAD_WORKERS):
+        # decoding is mostly disk bound, so threads are enough, failures are collected instead of aborting
+        paths = list(dict.fromkeys(paths))
+        decoded = {}
+        failures = []
+
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(paths)), 1)) as executor:
+            futures = dict(map(lambda x: (executor.submit(self.decode, x), x), paths))
+            for future in as_completed(futures):
+                samplePath = futures[future]
+                try:
+                    currentImport = future.result()
+                except Exception as e:
+                    failures.append((samplePath, e))
+                else:
+                    self.update_sample(WeaponFireSample.create(currentImport, samplePath, os.path.basename(samplePath)))
+                    self.source_paths[samplePath] = samplePath
+                    decoded[samplePath] = currentImport
+                if progress:
+                    progress(len(decoded) + len(failures), len(paths), samplePath)
+
+        self.conform_samples(decoded)
+        self.release_sources()
+        return failures
+
+    def reload_samples(self, force=False):
+        if self.source_cache is not None:
+            return self.invalidate_sources(force)
+
+        decoded = {}
+        for sample_key in self.samples:
+            sample = self.samples[sample_key]
+            # a changed path always decodes, even if the other file is known
+            if force or sample.source_sound is None or self.source_paths.get(sample_key) != sample.path:
+                source = self.decode(sample.path)
+            else:
+                source = self.decode_changed(sample.path)
+            if source is not None:
+                decoded[sample.path] = source
+            self.source_paths[sample_key] = sample.path
+            sample.name = os.path.basename(sample.path)
+        self.conform_samples(decoded)
+        return list(decoded)
 
-    def reload_samples(self):
+    def invalidate_sources(self, force=False):
+        # lazy reload, changed files are only dropped and decoded again on their next render
+        invalidated = []
         for sample_key in self.samples:
-            self.samples[sample_key].source_sound = AudioSegment.from_file(self.samples[sample_key].path, format="wav")
-            self.samples[sample_key].name = os.path.basename(self.samples[sample_key].path)
-        
+            sample = self.samples[sample_key]
+            if not force and sample.path in self.source_formats and self.source_paths.get(sample_key) == sample.path:
+                if not self.source_changed(sample.path):
+                    continue
+                stats = file_stats(sample.path)
+                self.source_stats[sample.path] = (stats[0], stats[1], None)
+            elif sample.path not in self.source_stats or force:
+                # no hash until the first decode, size and mtime are enough to notice changes until then
+                stats = file_stats(sample.path)
+                self.source_stats[sample.path] = (stats[0], stats[1], None)
+
+            try:
+                self.source_formats[sample.path] = read_format(sample.path)
+            except UnsupportedWav:
+                self.decode(sample.path)
+            self.drop_source(sample)
+            self.source_paths[sample_key] = sample.path
+            sample.name = os.path.basename(sample.path)
+            invalidated.append(sample.path)
+        self.conform_samples()
+        return invalidated
+
+    def drop_source(self, sample):
+        sample.source_sound = None
+        sample.clear_render_cache()
+        if self.source_cache is not None:
+            self.source_cache.pop(sample.path)
+
+    def lazy_source(self, sample):
+        source = self.source_cache.get(sample.path)
+        self.metrics.inc("memory_cache_misses_total" if source is None else "memory_cache_hits_total", labels={"cache": "source"})
+        if source is None:
+            frame_rate, sample_width, channels = self.target_format()
+            source = sync_segment(self.decode(sample.path), channels, frame_rate, sample_width)
+            self.source_cache.put(sample.path, source)
+        return source
+
+    def evicted_source(self, path, source):
+        # derived renders would keep the evicted source alive
+        self.metrics.inc("memory_cache_evictions_total", labels={"cache": "source"})
+        sample = self.samples.get(path)
+        if sample is not None:
+            sample.clear_render_cache()
+
+    def set_source_budget(self, max_bytes):
+        # None keeps every source decoded, a budget decodes sources on their first render and keeps them in an LRU
+        if max_bytes is None:
+            self.source_cache = None
+            for sample in self.samples.values():
+                sample.set_source_loader(None)
+            self.reload_samples(True)
+            return
+
+        if self.source_cache is None:
+            self.source_cache = MemoryBoundedLRU.create(max_bytes, segment_nbytes, self.evicted_source)
+            self.release_sources()
+        else:
+            self.source_cache.resize(max_bytes)
+
+    def release_sources(self):
+        # moves resident sources into the lru, the samples load them back through it
+        if self.source_cache is None:
+            return
+        for sample in self.samples.values():
+            sample.set_source_loader(self.lazy_source)
+            source = sample.resident_source()
+            if source is not None:
+                sample.source_sound = None
+                self.source_cache.put(sample.path, source)
+
+    def target_format(self):
+        # unset parts follow the largest source, which is what overlaying them used to convert to
+        formats = list(map(lambda x: self.source_formats[x], filter(lambda x: x in self.source_formats, self.samples)))
+        frame_rate = self.frame_rate or max(map(lambda x: x[0], formats), default=None)
+        sample_width = self.sample_width or max(map(lambda x: x[1], formats), default=None)
+        channels = self.channels or max(map(lambda x: x[2], formats), default=None)
+        return (frame_rate, sample_width, channels)
+
+    def conform_samples(self, decoded=None):
+        # every source is converted once here, so mixing never has to
+        decoded = decoded or {}
+        frame_rate, sample_width, channels = self.target_format()
+        for sample in self.samples.values():
+            source = decoded.get(sample.path, sample.resident_source())
+            if self.source_cache is not None and sample.path in self.source_cache:
+                cached = self.source_cache.get(sample.path)
+                if (cached.frame_rate, cached.sample_width, cached.channels) != (frame_rate, sample_width, channels):
+                    self.drop_source(sample)
+            if source is None or sample.path not in self.source_formats:
+                continue
+            if (source.frame_rate, source.sample_width, source.channels) != (frame_rate, sample_width, channels) and sample.path not in decoded:
+                # conformed to an older format, start over from the file
+                source = self.decode(sample.path)
+            with stage("conform", {"path": sample.path}):
+                sample.source_sound = sync_segment(source, channels, frame_rate, sample_width)
+
+    def set_format(self, frame_rate=None, sample_width=None, channels=None):
+        if (frame_rate, sample_width, channels) == (self.frame_rate, self.sample_width, self.channels):
+            return
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.conform_samples()
+
+    def remove_order_entry(self, key):
+        entry = self.order_entries.pop(key, None)
+        if entry:
+            del self.sample_order[bisect.bisect_left(self.sample_order, entry)]
+
     def remove_sample(self, sample):
-        self.samples = dict(filter(lambda x: x[0] != sample.path, self.samples.items()))
-    
+        self.remove_order_entry(sample.path)
+        self.samples.pop(sample.path, None)
+
     def get_samples_list(self):
-        return list(self.samples.values())
+        return list(map(lambda x: self.samples[x[2]], self.sample_order))
 
     def update_sample(self, sample):
+        if self.pitch_cache_bytes is not None:
+            sample.set_pitch_cache_size(self.pitch_cache_bytes)
+        if self.source_cache is not None:
+            sample.set_source_loader(self.lazy_source)
+        sample.set_metrics(self.metrics)
+        # samples stay ordered by name and path, inserting never sorts everything again
+        self.remove_order_entry(sample.path)
+        entry = (sample.name, sample.path, sample.path)
+        bisect.insort(self.sample_order, entry)
+        self.order_entries[sample.path] = entry
         self.samples[sample.path] = sample
 
+    def set_pitch_cache_size(self, max_bytes):
+        self.pitch_cache_bytes = max_bytes
+        for sample in self.samples.values():
+            sample.set_pitch_cache_size(max_bytes)
+
+    def share_sources(self):
+        return SharedSourceBlocks.create(self.get_samples_list())
+
     def clear(self):
+        if self.source_cache is not None:
+            self.source_cache.clear()
         self.samples = {}
-
+        self.source_formats = {}
+        self.source_stats = {}
+        self.source_paths = {}
+        self.sample_order = []
+        self.order_entries = {}
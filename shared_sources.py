@@ -0,0 +1,60 @@
+from multiprocessing import shared_memory
+from audio_bridge import SAMPLE_TYPES, segment_samples, view_segment
+import atexit, numpy
+
+attached_blocks = []
+
+class SharedSourceBlocks:
+    def __init__(self):
+        self.blocks = []
+        self.descriptors = {}
+        atexit.register(self.close)
+
+    @staticmethod
+    def create(samples):
+        shared = SharedSourceBlocks()
+        try:
+            for sample in samples:
+                shared.add(sample.path, sample.source_sound)
+        except Exception as e:
+            shared.close()
+            raise e
+        return shared
+
+    def add(self, key, source):
+        samples = segment_samples(source)
+        block = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+        self.blocks.append(block)
+        numpy.ndarray(samples.shape, dtype=samples.dtype, buffer=block.buf)[:] = samples
+        self.descriptors[key] = (block.name, samples.nbytes, source.frame_rate, source.sample_width, source.channels)
+
+    def close(self):
+        for block in self.blocks:
+            try:
+                block.close()
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        self.blocks = []
+        self.descriptors = {}
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def attach_source(descriptor):
+    name, size, frame_rate, sample_width, channels = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    # the block has to stay open for as long as views on it exist
+    attached_blocks.append(block)
+
+    samples = numpy.ndarray((size // (sample_width * channels), channels), dtype=SAMPLE_TYPES[sample_width], buffer=block.buf)
+    samples.flags.writeable = False
+    # worker sources are only rendered from, never handed out, so they stay a view on the block
+    return view_segment(samples, frame_rate, sample_width)
+
+def attach_sources(descriptors):
+    return dict(map(lambda x: (x[0], attach_source(x[1])), descriptors.items()))
@@ -0,0 +1,107 @@
+from pydub.utils import db_to_float
+import numpy
+
+def silent_ranges(samples, frame_rate, max_possible, silence_len, silence_thresh, scale=1.0):
+    # (starts, ends) in ms of the silent ranges pydub's detect_silence finds
+    frames = len(samples)
+    ms_frames = frame_rate / 1000.0
+    len_ms = length_ms(samples, frame_rate)
+    none = (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+    if len_ms < silence_len:
+        return none
+
+    # windowed rms per ms from a cumulative sum of squares, truncated like audioop.rms
+    energy = numpy.square(samples, dtype=numpy.float64).sum(axis=1)
+    if scale != 1.0:
+        energy *= scale * scale
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(energy)))
+
+    starts_ms = numpy.arange(len_ms - silence_len + 1)
+    starts = numpy.minimum((starts_ms * ms_frames).astype(numpy.int64), frames)
+    ends = ((starts_ms + silence_len) * ms_frames).astype(numpy.int64)
+    # pydub pads windows past the last frame with silence, which still counts for the mean
+    counts = numpy.maximum(ends - starts, 1) * samples.shape[1]
+    rms = numpy.floor(numpy.sqrt((cumulative[numpy.minimum(ends, frames)] - cumulative[starts]) / counts))
+    silent = numpy.flatnonzero(rms <= db_to_float(silence_thresh) * max_possible)
+    if len(silent) == 0:
+        return none
+
+    # silent windows closer than silence_len merge into one range, just like pydub
+    breaks = numpy.flatnonzero(numpy.diff(silent) > silence_len)
+    range_starts = numpy.concatenate(([silent[0]], silent[breaks + 1]))
+    range_ends = numpy.concatenate((silent[breaks], [silent[-1]])) + silence_len
+    return (range_starts, range_ends)
+
+def nonsilent_ranges(samples, frame_rate, max_possible, silence_len, silence_thresh, padding, scale=1.0):
+    # [start, end] in ms of the chunks pydub's split_on_silence keeps, padding included, empty when all is silent
+    len_ms = length_ms(samples, frame_rate)
+    silent_starts, silent_ends = silent_ranges(samples, frame_rate, max_possible, silence_len, silence_thresh, scale)
+    if len(silent_starts) > 0 and silent_starts[0] == 0 and silent_ends[0] == len_ms:
+        return []
+
+    starts = numpy.concatenate(([0], silent_ends))
+    ends = numpy.concatenate((silent_starts, [len_ms]))
+    if len(silent_ends) > 0 and silent_ends[-1] == len_ms:
+        starts = starts[:-1]
+        ends = ends[:-1]
+    if starts[0] == 0 and ends[0] == 0:
+        starts = starts[1:]
+        ends = ends[1:]
+
+    starts = starts - padding
+    ends = ends + padding
+    # paddings that overlap are split halfway between the chunks
+    overlapping = numpy.flatnonzero(starts[1:] < ends[:-1])
+    middles = (ends[overlapping] + starts[overlapping + 1]) // 2
+    ends[overlapping] = middles
+    starts[overlapping + 1] = middles
+    return list(zip(numpy.maximum(starts, 0).tolist(), numpy.minimum(ends, len_ms).tolist()))
+
+def length_ms(samples, frame_rate):
+    # len() of the pydub segment holding samples
+    return round(1000 * (len(samples) / frame_rate))
+
+def slice_ms(samples, frame_rate, start, end=None):
+    # the frames the pydub slice [start:end] in ms holds
+    len_ms = length_ms(samples, frame_rate)
+    ms_frames = frame_rate / 1000.0
+    start = int(min(start, len_ms) * ms_frames)
+    end = int((len_ms if end is None else min(end, len_ms)) * ms_frames)
+    if end <= len(samples):
+        return samples[start:end]
+
+    # only the rounding of the last ms can end past the data, pydub fills that with silence
+    padded = numpy.zeros((end - start, samples.shape[1]), dtype=samples.dtype)
+    padded[:len(samples) - start] = samples[start:]
+    return padded
+
+def fade_whole(samples, frame_rate, from_power, to_power):
+    # pydub's fade over all of a short segment: one linear gain step per frame over its rounded length
+    fade_frames = length_ms(samples, frame_rate) * (frame_rate / 1000.0)
+    count = min(int(fade_frames), len(samples))
+    gains = from_power + (to_power - from_power) / fade_frames * numpy.arange(count)
+    return samples[:count] * gains[:, None]
+
+def crossfade_chunks(chunks, frame_rate, crossfade):
+    # the chunks appended like pydub's append, frame for frame, faded between silence (-120 dB) and full scale
+    silence = db_to_float(-120)
+    joined = chunks[0]
+    for chunk in chunks[1:]:
+        len_ms = length_ms(joined, frame_rate)
+        fade_out = fade_whole(slice_ms(joined, frame_rate, len_ms - crossfade), frame_rate, 1.0, silence)
+        fade_in = fade_whole(slice_ms(chunk, frame_rate, 0, crossfade), frame_rate, silence, 1.0)
+        # the fade in is looped over the whole fade out, like overlay(loop=True) does
+        fade_out = slice_ms(fade_out, frame_rate, 0)
+        overlap = fade_out + numpy.resize(fade_in, (len(fade_out), fade_in.shape[1]))
+        joined = numpy.concatenate((slice_ms(joined, frame_rate, 0, len_ms - crossfade), overlap.astype(joined.dtype), slice_ms(chunk, frame_rate, crossfade)))
+    return joined
+
+def trim_silence(samples, frame_rate, max_possible, silence_len, silence_thresh, padding, scale=1.0):
+    # a view when only the ends are silent, silent gaps inside are cut out and the chunks crossfaded like strip_silence
+    ranges = nonsilent_ranges(samples, frame_rate, max_possible, silence_len, silence_thresh, padding, scale)
+    if len(ranges) == 0:
+        return samples[:0]
+    chunks = list(map(lambda x: slice_ms(samples, frame_rate, x[0], x[1]), ranges))
+    if len(chunks) == 1:
+        return chunks[0]
+    return crossfade_chunks(chunks, frame_rate, padding / 2)
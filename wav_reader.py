@@ -0,0 +1,141 @@
+from audio_bridge import samples_segment
+import numpy, struct, json, os, io
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# json written next to the samples of render cache entries
+METADATA_CHUNK = b'wfmd'
+
+class UnsupportedWav(ValueError):
+    pass
+
+class WavHeader:
+    def __init__(self, format_tag, channels, frame_rate, bits, data_offset, frames, metadata):
+        self.format_tag = format_tag
+        self.channels = channels
+        self.frame_rate = frame_rate
+        self.bits = bits
+        self.data_offset = data_offset
+        self.frames = frames
+        self.metadata = metadata
+
+    @staticmethod
+    def create(format_tag, channels, frame_rate, bits, data_offset, data_size, metadata=None):
+        if format_tag == WAVE_FORMAT_PCM and bits not in [8, 16, 24, 32]:
+            raise UnsupportedWav("Unsupported PCM bit depth: " + str(bits))
+        if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits not in [32, 64]:
+            raise UnsupportedWav("Unsupported float bit depth: " + str(bits))
+        if format_tag not in [WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT]:
+            raise UnsupportedWav("Unsupported format tag: " + str(format_tag))
+        if channels < 1 or frame_rate < 1:
+            raise UnsupportedWav("Invalid fmt chunk")
+        return WavHeader(format_tag, channels, frame_rate, bits, data_offset, data_size // (channels * bits // 8), metadata)
+
+    def sample_width(self):
+        # what the source ends up as: 8 and 16 bit stay, everything else becomes 32 bit int like pydub's 24 bit path
+        return self.bits // 8 if self.format_tag == WAVE_FORMAT_PCM and self.bits in [8, 16] else 4
+
+def read_header(path):
+    with open(path, 'rb') as fp:
+        return parse_header(fp, os.path.getsize(path), path)
+
+def parse_header(fp, file_size, path):
+    riff = fp.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise UnsupportedWav("Not a RIFF/WAVE file: " + path)
+
+    fmt = None
+    metadata = None
+    while True:
+        chunk = fp.read(8)
+        if len(chunk) < 8:
+            raise UnsupportedWav("No data chunk: " + path)
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+
+        if chunk_id == b'fmt ':
+            fmt = fp.read(chunk_size)
+            if len(fmt) < 16:
+                raise UnsupportedWav("Truncated fmt chunk: " + path)
+            if chunk_size % 2:
+                fp.seek(1, os.SEEK_CUR)
+        elif chunk_id == METADATA_CHUNK:
+            metadata = fp.read(chunk_size)
+            if chunk_size % 2:
+                fp.seek(1, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise UnsupportedWav("data chunk before fmt chunk: " + path)
+            data_offset = fp.tell()
+            # streamed files leave the size at 0 or 0xFFFFFFFF
+            data_size = min(chunk_size, file_size - data_offset) if chunk_size else file_size - data_offset
+            break
+        else:
+            fp.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+    format_tag, channels, frame_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(fmt) < 40:
+            raise UnsupportedWav("Truncated extensible fmt chunk: " + path)
+        # the sub format guid starts with the plain format tag
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    if metadata is not None:
+        metadata = json.loads(metadata.decode("utf-8"))
+    return WavHeader.create(format_tag, channels, frame_rate, bits, data_offset, data_size, metadata)
+
+def read_format(path):
+    # (frame_rate, sample_width, channels) of the source read_wav returns, without touching the samples
+    header = read_header(path)
+    return (header.frame_rate, header.sample_width(), header.channels)
+
+def sample_layout(header):
+    # (dtype, shape) of the data chunk as stored
+    if header.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return (numpy.dtype('<f' + str(header.bits // 8)), (header.frames, header.channels))
+    if header.bits == 24:
+        return (numpy.dtype(numpy.uint8), (header.frames, header.channels, 3))
+    return (numpy.dtype({8: numpy.uint8, 16: '<i2', 32: '<i4'}[header.bits]), (header.frames, header.channels))
+
+def buffer_samples(data, header):
+    dtype, shape = sample_layout(header)
+    return numpy.frombuffer(data, dtype=dtype, count=int(numpy.prod(shape)), offset=header.data_offset).reshape(shape)
+
+def to_pcm(samples, header):
+    # 16 and 32 bit int stay a view on the buffer until the segment copies them, the rest is converted once
+    if header.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        scaled = samples.astype(numpy.float64) * 2147483648.0
+        numpy.clip(scaled, -2147483648.0, 2147483647.0, out=scaled)
+        return scaled.astype(numpy.int32)
+    if header.bits == 24:
+        # same bytes as pydub's conversion, which fills the low byte with the sign
+        padded = numpy.empty(samples.shape[:2] + (4,), dtype=numpy.uint8)
+        padded[:, :, 0] = numpy.where(samples[:, :, 2] > 0x7f, 0xff, 0)
+        padded[:, :, 1:] = samples
+        return padded.view('<i4').reshape(samples.shape[:2])
+    if header.bits == 8:
+        return (samples ^ numpy.uint8(0x80)).view(numpy.int8)
+    return samples
+
+def parse_wav_data(data, path):
+    header = parse_header(io.BytesIO(data), len(data), path)
+    samples = to_pcm(buffer_samples(data, header), header)
+    return (samples_segment(samples, header.frame_rate, header.sample_width()), header)
+
+def read_wav_data(data, path=""):
+    # a whole wav file already in memory
+    try:
+        return parse_wav_data(data, path)[0]
+    except (struct.error, ValueError) as e:
+        raise UnsupportedWav(str(e))
+
+def read_wav(path, with_header=False):
+    # read whole, files are never left mapped, they may be replaced or deleted while segments of them are in use
+    try:
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        segment, header = parse_wav_data(data, path)
+    except (struct.error, ValueError, OSError) as e:
+        if isinstance(e, FileNotFoundError):
+            raise e
+        raise UnsupportedWav(str(e))
+    return (segment, header) if with_header else segment
@@ -0,0 +1,113 @@
+from audio_bridge import segment_samples, sample_type
+from wav_reader import METADATA_CHUNK
+import numpy, struct, json
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+EXPORT_PCM8 = "pcm8"
+EXPORT_PCM16 = "pcm16"
+EXPORT_PCM24 = "pcm24"
+EXPORT_PCM32 = "pcm32"
+EXPORT_FLOAT32 = "float32"
+# (format tag, bits per sample), None keeps the sample width of the rendered audio
+EXPORT_FORMATS = {EXPORT_PCM8: (WAVE_FORMAT_PCM, 8), EXPORT_PCM16: (WAVE_FORMAT_PCM, 16), EXPORT_PCM24: (WAVE_FORMAT_PCM, 24), EXPORT_PCM32: (WAVE_FORMAT_PCM, 32), EXPORT_FLOAT32: (WAVE_FORMAT_IEEE_FLOAT, 32)}
+
+CHUNK_FRAMES = 1 << 16
+
+def export_layout(sample_width, export_format=None):
+    if export_format is None:
+        return (WAVE_FORMAT_PCM, sample_width * 8)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format: " + str(export_format))
+    return EXPORT_FORMATS[export_format]
+
+def convert_chunk(samples, sample_width, format_tag, bits):
+    # int samples of sample_width to the little endian layout of the file
+    source_bits = sample_width * 8
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return (samples * (1.0 / (1 << (source_bits - 1)))).astype('<f4')
+
+    if bits == source_bits and bits != 8:
+        return samples.astype('<i' + str(sample_width), copy=False)
+
+    # widening shifts up, narrowing truncates like audioop.lin2lin
+    values = samples.astype(numpy.int64)
+    if bits > source_bits:
+        values <<= bits - source_bits
+    else:
+        values >>= source_bits - bits
+
+    if bits == 8:
+        # wav stores 8 bit samples unsigned
+        return (values + 128).astype(numpy.uint8)
+    if bits == 24:
+        return numpy.ascontiguousarray(values.astype('<i4').view(numpy.uint8).reshape(samples.shape + (4,))[..., :3])
+    return values.astype('<i' + str(bits // 8))
+
+class WavWriter:
+    def __init__(self, fp, frame_rate, channels, sample_width, format_tag, bits, metadata):
+        self.fp = fp
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.format_tag = format_tag
+        self.bits = bits
+        self.metadata = metadata
+        self.frames = 0
+        self.write_header()
+
+    @staticmethod
+    def create(path, frame_rate, channels, sample_width, export_format=None, metadata=None):
+        format_tag, bits = export_layout(sample_width, export_format)
+        sample_type(sample_width)
+        metadata = json.dumps(metadata, sort_keys=True).encode("utf-8") if metadata is not None else b''
+        return WavWriter(open(path, 'wb'), frame_rate, channels, sample_width, format_tag, bits, metadata)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def data_size(self):
+        return self.frames * self.channels * (self.bits // 8)
+
+    def header(self):
+        block_align = self.channels * (self.bits // 8)
+        data_size = self.data_size()
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            # non pcm formats carry a cbSize field and a fact chunk
+            fmt = struct.pack('<HHIIHHH', self.format_tag, self.channels, self.frame_rate, self.frame_rate * block_align, block_align, self.bits, 0)
+            extra = b'fact' + struct.pack('<II', 4, self.frames)
+        else:
+            fmt = struct.pack('<HHIIHH', self.format_tag, self.channels, self.frame_rate, self.frame_rate * block_align, block_align, self.bits)
+            extra = b''
+        if self.metadata:
+            extra = extra + METADATA_CHUNK + struct.pack('<I', len(self.metadata)) + self.metadata + b'\0' * (len(self.metadata) % 2)
+        riff_size = 4 + 8 + len(fmt) + len(extra) + 8 + data_size + data_size % 2
+        return b'RIFF' + struct.pack('<I', riff_size) + b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + extra + b'data' + struct.pack('<I', data_size)
+
+    def write_header(self):
+        self.fp.seek(0)
+        self.fp.write(self.header())
+
+    def write(self, samples):
+        # (frames, channels) int samples of sample_width, written in large chunks without joining them first
+        samples = samples.reshape(-1, self.channels)
+        for start in range(0, len(samples), CHUNK_FRAMES):
+            self.fp.write(convert_chunk(samples[start:start + CHUNK_FRAMES], self.sample_width, self.format_tag, self.bits))
+        self.frames += len(samples)
+
+    def close(self):
+        if self.fp.closed:
+            return
+        if self.data_size() % 2:
+            self.fp.write(b'\0')
+        # the sizes are only known at the end
+        self.write_header()
+        self.fp.close()
+
+def export_wav(segment, path, export_format=None):
+    with WavWriter.create(path, segment.frame_rate, segment.channels, segment.sample_width, export_format) as writer:
+        writer.write(segment_samples(segment))
@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+from weapon_fire_loop_generator import WeaponFireLoopGenerator
+from render_engine import RENDER_ENGINES
+from resampler import RESAMPLE_QUALITIES
+from wav_writer import EXPORT_FORMATS
+import argparse, glob, os, sys, time, traceback
+
+TRACE_EXTENSION = ".trace.json"
+METRICS_EXTENSION = ".prom"
+
+def find_configs(patterns):
+    configs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                match = os.path.join(match, "config.json")
+            if match not in configs:
+                configs.append(match)
+    return configs
+
+def render_project(config_path, target_path=None, engine=None, quality=None, workers=0, verbose=False, export_format=None, incremental=False, render_cache=None, profile=False, metrics_path=None):
+    start = time.perf_counter()
+    generator = WeaponFireLoopGenerator.create(lambda text: None)
+    generator.print_log = verbose
+    generator.import_project(config_path)
+
+    if target_path:
+        generator.set_target_directory(target_path)
+    if engine:
+        generator.set_render_engine(engine, quality)
+    if export_format:
+        generator.set_export_format(export_format)
+    if render_cache:
+        generator.set_render_cache(render_cache)
+    generator.set_export_workers(workers)
+    if metrics_path:
+        os.makedirs(metrics_path, exist_ok=True)
+        generator.set_metrics_textfile(os.path.join(metrics_path, generator.current_loop_settings.prefix + METRICS_EXTENSION))
+
+    if not os.path.exists(generator.current_loop_settings.target_path):
+        os.makedirs(generator.current_loop_settings.target_path)
+
+    if profile:
+        settings = generator.current_loop_settings
+        trace_path = os.path.join(settings.target_path, settings.prefix, settings.prefix + TRACE_EXTENSION)
+        profiler = generator.export_profiled(trace_path, incremental)
+        print(config_path + "\n" + profiler.summary_table())
+    else:
+        generator.export_all(incremental)
+    return time.perf_counter() - start
+
+def run_project(args):
+    try:
+        return (args[0], render_project(*args), None)
+    except Exception:
+        return (args[0], None, traceback.format_exc())
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Render weapon fire projects (config.json) without the UI.")
+    parser.add_argument("configs", nargs="+", help="config.json files, project directories or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="projects rendered at once")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="export workers per project (0 renders serially)")
+    parser.add_argument("-t", "--target-path", help="override the target path of every project")
+    parser.add_argument("-e", "--engine", choices=list(RENDER_ENGINES), help="render engine")
+    parser.add_argument("-q", "--quality", choices=RESAMPLE_QUALITIES, help="resample quality of the numpy engine")
+    parser.add_argument("-f", "--export-format", choices=list(EXPORT_FORMATS), help="bit depth of the exported wavs (default: project setting)")
+    parser.add_argument("-i", "--incremental", action="store_true", help="only render outputs whose inputs changed since the last export")
+    parser.add_argument("-c", "--render-cache", help="render cache directory shared by all projects and runs")
+    parser.add_argument("-p", "--profile", action="store_true", help="time every render stage, writes <prefix>" + TRACE_EXTENSION + " next to the render directory and prints a summary")
+    parser.add_argument("-m", "--metrics-dir", help="write <prefix>" + METRICS_EXTENSION + " prometheus textfiles here after every project (e.g. the node exporter textfile directory)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the render log of every project")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    configs = find_configs(args.configs)
+
+    if len(configs) == 0:
+        print("No projects found")
+        return 2
+
+    jobs = [(config, args.target_path, args.engine, args.quality, args.workers, args.verbose, args.export_format, args.incremental, args.render_cache, args.profile, args.metrics_dir) for config in configs]
+    failed = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=max(min(args.jobs, len(jobs)), 1)) as executor:
+        for config, elapsed, error in executor.map(run_project, jobs):
+            if error:
+                failed = failed + 1
+                print("FAILED " + config)
+                print(error)
+            else:
+                print("{:8.2f}s {}".format(elapsed, config))
+
+    print("{} rendered, {} failed in {:.2f}s".format(len(jobs) - failed, failed, time.perf_counter() - start))
+    return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
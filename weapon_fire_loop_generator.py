@@ -1,23 +1,37 @@
 from weapon_fire_loop_settings import WeaponFireLoopSettings
 from weapon_fire_sample import WeaponFireSample
 from sample_manager import SampleManager
-import shutil, os, numpy, sys, math, json
-
-from pydub import AudioSegment
-from pydub.playback import play, _play_with_pyaudio
-from pydub.effects import normalize, strip_silence
-import winsound
-
-KINDA_BIG_NUMBER = 999999999
+from render_engine import create_render_engine, PydubRenderEngine, RENDER_DEFAULT, RENDER_LOOPED, RENDER_TAIL, RENDER_VERSION
+from loop_mixer import mix_schedule, mix_schedule_fused, stream_schedule, mono_segment
+from parallel_export import export_tasks, render_tasks, split_results, split_fused, TASK_DEFAULT, TASK_TAIL, TASK_BURST, TASK_LOOP
+from wav_writer import export_wav, export_layout
+from render_manifest import RenderManifest, inputs_key
+from render_cache import DiskRenderCache, DEFAULT_RENDER_CACHE_BYTES
+from render_profiler import stage
+from render_metrics import RenderMetrics
+from audio_bridge import segment_nbytes
+import render_profiler
+from fire_schedule import SequenceSchedule, schedule_rng, draw_sequence, draw_tails, draw_cents, STREAM_TAIL, STREAM_BURST, STREAM_LOOP
+import shutil, os, numpy, math, json, time
+
+SCHEDULE_EXTENSION = ".schedule.json"
 
 class WeaponFireLoopGenerator:
     def __init__(self, log_callback):
         self.current_loop_settings = WeaponFireLoopSettings.create()
-        self.sample_manager = SampleManager.create()
+        self.metrics = RenderMetrics.create()
+        self.metrics_textfile = None
+        self.sample_manager = SampleManager.create(self.metrics)
         self.current_sample = None
         self.current_preview = None
         self.current_sample_copy = None
         self.log_callback = log_callback
+        self.render_engine = PydubRenderEngine.create()
+        self.export_workers = 0
+        self.render_cache = None
+        # per sample render cache and manifest inputs, fixed while an export runs
+        self.export_inputs = None
+        self.print_log = True
 
     @staticmethod
     def create(log_callback):
@@ -28,8 +42,11 @@ class WeaponFireLoopGenerator:
         return text if len(text) <= max_width else text[:left_width] + "..." + text[left_width-max_width:]
 
     def open_files(self, paths):
-        self.sample_manager.load_files(paths)
-        
+        progress = lambda done, total, path: self.log("Loading samples (" + str(done) + "/" + str(total) + ") " + WeaponFireLoopGenerator.prevent_overflow(path, 44))
+        failures = self.sample_manager.load_files(paths, progress)
+        for path, error in failures:
+            self.log("Failed to load " + WeaponFireLoopGenerator.prevent_overflow(path, 44) + ": " + str(error), True)
+
         samples = self.sample_manager.get_samples_list()
         if len(samples) > 0:
             self.current_sample = samples[0]
@@ -42,8 +59,36 @@ class WeaponFireLoopGenerator:
             self.sample_manager.remove_sample(self.current_sample)
             self.current_sample = None
 
+    def set_render_engine(self, name, quality=None):
+        self.render_engine = create_render_engine(name, quality)
+
+    def set_source_budget(self, max_bytes):
+        self.sample_manager.set_source_budget(max_bytes)
+
+    def set_render_cache(self, path, max_bytes=DEFAULT_RENDER_CACHE_BYTES):
+        # renders are kept on disk across sessions, None renders everything again
+        self.render_cache = DiskRenderCache.create(path, max_bytes) if path else None
+
+    def set_metrics_textfile(self, path):
+        # prometheus textfile written after every export_all, None turns it off
+        self.metrics_textfile = path
+
+    def set_export_workers(self, workers):
+        self.export_workers = max(workers, 0)
+
     def set_current_loop_settings(self, nu_settings):
         self.current_loop_settings = nu_settings
+        self.sample_manager.set_format(nu_settings.frame_rate, nu_settings.sample_width, nu_settings.channels)
+
+    def set_project_format(self, frame_rate=None, sample_width=None, channels=None):
+        self.current_loop_settings.frame_rate = frame_rate
+        self.current_loop_settings.sample_width = sample_width
+        self.current_loop_settings.channels = channels
+        self.sample_manager.set_format(frame_rate, sample_width, channels)
+
+    def set_export_format(self, export_format):
+        export_layout(2, export_format)
+        self.current_loop_settings.export_format = export_format
 
     def set_current_sample(self, sample):
         self.current_sample = sample
@@ -61,104 +106,210 @@ class WeaponFireLoopGenerator:
             self.current_sample.tail_offset_ms = self.current_sample_copy.tail_offset_ms
             self.current_sample.tail_fadein_ms = self.current_sample_copy.tail_fadein_ms
             self.current_sample.solo = self.current_sample_copy.solo
+            self.current_sample.fade_curve = self.current_sample_copy.fade_curve
             self.sample_manager.reload_samples()
 
-    def generate_sequences(self, is_burst, seed, variations=1):
-        numpy.random.seed(seed) 
-        
+    def generate_schedules(self, is_burst, seed, variations, mono):
+        stream = STREAM_BURST if is_burst else STREAM_LOOP
         rpm = self.current_loop_settings.rpm_burst if is_burst else self.current_loop_settings.rpm
         count = self.current_loop_settings.burst_count if is_burst else self.current_loop_settings.fire_count
-        
-        raw_sequences = []
-
-        state = " - Burst " if is_burst else " - Auto "
 
-        mono_str = "mono" if self.current_loop_settings.mono_loop else "default"
-
-        self.log("Generating variations" + state + "(" + mono_str + ") ...", True)
+        return [self.generate_schedule(count, rpm, schedule_rng(seed, stream, i), mono) for i in range(variations)]
 
-        for i in range(variations):
-            raw_sequences.append((self.generate_list_sequence(count), None))
+    def generate_schedule(self, count, rpm, rng, mono):
+        samples = self.sample_manager.get_samples_list()
 
-        audio = []
+        # one vectorized draw for the whole sequence instead of two per shot
+        indices, cents = draw_sequence(rng, samples, count)
 
-        avg_boost = 0.0
+        used = list(map(lambda x: samples[x].source_sound, numpy.unique(indices)))
+        frame_rate = max(map(lambda x: x.frame_rate, used))
+        channels = 1 if mono else max(map(lambda x: x.channels, used))
+        sample_width = max(map(lambda x: x.sample_width, used))
 
-        self.log("Mixing audio" + state + "(" + mono_str + ") ...", True)
-
-        for raw in raw_sequences:
-            render = self.mix_sequence(raw[0], rpm)
-            avg_boost = avg_boost + render[1]
-            audio.append(render[0])
+        time_between_ms = math.ceil((60.0 * 1000) / rpm) 
+        offsets = (numpy.arange(count, dtype=numpy.int64) * time_between_ms * frame_rate) // 1000
 
-        if avg_boost > 0:
-            avg_boost = avg_boost / len(raw_sequences)
+        return SequenceSchedule.create(list(map(lambda x: x.path, samples)), indices, cents, offsets, frame_rate, channels, sample_width, mono)
 
-        return (audio, avg_boost)
+    def generate_sequences(self, is_burst, seed, variations=1, stream_path=None, fused=False):
+        state = " - Burst " if is_burst else " - Auto "
 
-    def mix_sequence(self, raw_sequence, rpm):
-        count = len(raw_sequence)
-        time_between_ms = math.ceil((60.0 * 1000) / rpm) 
-        last_sample_len = len(raw_sequence[-1])
-        total_length = (count - 1) * time_between_ms + last_sample_len
+        mono_str = "mono" if self.current_loop_settings.mono_loop else "default"
 
-        mix = AudioSegment.silent(duration=total_length)
+        self.log("Generating variations" + state + "(" + mono_str + ") ...", True)
 
-        offset = 0
-        for sample in raw_sequence:
-            mix = mix.overlay(sample, position=offset)
-            offset = offset + time_between_ms
+        schedules = self.generate_schedules(is_burst, seed, variations, self.current_loop_settings.mono_loop)
 
-            
-        max_old = mix.max_dBFS
+        self.log("Mixing audio" + state + "(" + mono_str + ") ...", True)
 
-        if self.current_loop_settings.normalize:
-            mix = normalize(mix)
-        
-        diff = abs(max_old - mix.max_dBFS)
+        renders = []
+        for i in range(len(schedules)):
+            start = time.perf_counter()
+            if stream_path:
+                # streamed sequences are written right away and only their volume diff is kept
+                mono_target = self.loop_target(stream_path, "mono")(i) if fused else None
+                diffs = self.stream_sequence(schedules[i], self.loop_target(stream_path, mono_str)(i), mono_target)
+                render = ((None, diffs[0]), (None, diffs[1])) if fused else (None, diffs[0])
+            else:
+                render = self.mix_sequence(schedules[i], fused)
+            self.metrics.observe("render_seconds", time.perf_counter() - start, {"output": "burst" if is_burst else "loop"})
+            renders.append(render)
+
+        if fused:
+            # the mono sequences are downmixed from the same mixes
+            mono_schedules = list(map(lambda x: x.as_mono(), schedules))
+            return (self.sequence_results(list(map(lambda x: x[0], renders)), schedules), self.sequence_results(list(map(lambda x: x[1], renders)), mono_schedules))
+        return self.sequence_results(renders, schedules)
+
+    def sequence_results(self, renders, schedules):
+        # (audio, average volume boost, schedules) from (audio, boost) per schedule
+        avg_boost = 0.0
+        for render in renders:
+            avg_boost = avg_boost + render[1]
 
-        return (mix, diff)
+        if avg_boost > 0:
+            avg_boost = avg_boost / len(renders)
+
+        return (list(map(lambda x: x[0], renders)), avg_boost, schedules)
+
+    def shot_renderer(self, schedule):
+        missing = list(filter(lambda x: x not in self.sample_manager.samples, schedule.used_paths()))
+        if len(missing) > 0:
+            raise ValueError("Samples of the schedule are not loaded: " + ", ".join(missing))
+
+        samples = self.sample_manager.samples
+        return lambda i: self.render_sample(samples[schedule.shot_path(i)], RENDER_LOOPED, schedule.mono, int(schedule.cents[i]))
+
+    def render_inputs(self):
+        return {"version": RENDER_VERSION, "engine": [self.render_engine.name, self.render_engine.quality], "format": list(self.sample_manager.target_format())}
+
+    def sample_inputs(self, sample, kind, source=None):
+        inputs = self.export_inputs.get((sample.path, kind)) if self.export_inputs else None
+        if inputs is None:
+            inputs = {"path": sample.path, "source": source or self.sample_manager.source_hash(sample.path), "params": list(sample.render_params(kind))}
+        return inputs
+
+    def collect_sample_inputs(self):
+        self.export_inputs = None
+        inputs = {}
+        for sample in self.sample_manager.get_samples_list():
+            source = self.sample_manager.source_hash(sample.path)
+            for kind in [RENDER_DEFAULT, RENDER_TAIL, RENDER_LOOPED]:
+                inputs[(sample.path, kind)] = self.sample_inputs(sample, kind, source)
+        return inputs
+
+    def run_with_inputs(self, run, needed):
+        # sources are checked and hashed once per run instead of on every shot, cache and manifest keys look them up
+        self.export_inputs = self.collect_sample_inputs() if needed else None
+        try:
+            return run()
+        finally:
+            self.export_inputs = None
+
+    def render_sample(self, sample, kind, mono, cents=None):
+        # one stage per rendered shot, so the summary counts them per kind
+        start = time.perf_counter()
+        with stage("render " + kind):
+            render = self.render_sample_cached(sample, kind, mono, cents)
+        self.metrics.inc("shots_rendered_total", labels={"kind": kind})
+        self.metrics.observe("render_seconds", time.perf_counter() - start, {"output": kind})
+        return render
+
+    def render_sample_cached(self, sample, kind, mono, cents=None):
+        if self.render_cache is None:
+            return sample.render(kind, mono, cents, self.render_engine)
+
+        key = inputs_key(dict(self.render_inputs(), sample=self.sample_inputs(sample, kind), kind=kind, mono=mono, cents=cents))
+        with stage("cache get"):
+            entry = self.cache_get(key, kind)
+        if entry is not None:
+            return entry[0]
+
+        render = sample.render(kind, mono, cents, self.render_engine)
+        with stage("cache put"):
+            self.cache_put(key, render)
+        return render
+
+    def cache_get(self, key, kind):
+        entry = self.render_cache.get(key)
+        if entry is None:
+            self.metrics.inc("render_cache_misses_total", labels={"kind": kind})
+            return None
+        self.metrics.inc("render_cache_hits_total", labels={"kind": kind})
+        self.metrics.inc("bytes_read_total", segment_nbytes(entry[0]), {"source": "render_cache"})
+        return entry
+
+    def cache_put(self, key, render, metadata=None):
+        self.render_cache.put(key, render, metadata)
+        self.metrics.inc("bytes_written_total", segment_nbytes(render), {"target": "render_cache"})
+
+    def sequence_key(self, schedule, output):
+        used = list(map(lambda x: self.sample_inputs(self.sample_manager.samples[x], RENDER_LOOPED), schedule.used_paths()))
+        return inputs_key(dict(self.render_inputs(), schedule=schedule.as_dict(), samples=used, normalize=self.current_loop_settings.normalize, output=output))
+
+    def mix_sequence(self, schedule, fused=False):
+        if self.render_cache is None:
+            return self.mix_fresh(schedule, fused)
+
+        # a fused mix is cached as the mix and its downmix
+        keys = list(map(lambda x: self.sequence_key(schedule, x), ["mix", "downmix"] if fused else ["mix"]))
+        entries = list(map(lambda x: self.cache_get(x, "sequence"), keys))
+        if all(map(lambda x: x is not None, entries)):
+            renders = list(map(lambda x: (x[0], x[1]["diff"]), entries))
+            return tuple(renders) if fused else renders[0]
+
+        renders = self.mix_fresh(schedule, fused)
+        for key, render in zip(keys, renders if fused else [renders]):
+            self.cache_put(key, render[0], {"diff": render[1]})
+        return renders
+
+    def mix_fresh(self, schedule, fused=False):
+        if fused:
+            return mix_schedule_fused(schedule, self.shot_renderer(schedule), self.current_loop_settings.normalize)
+        return mix_schedule(schedule, self.shot_renderer(schedule), self.current_loop_settings.normalize)
+
+    def stream_sequence(self, schedule, target_file, mono_file=None):
+        diffs = stream_schedule(schedule, self.shot_renderer(schedule), self.current_loop_settings.normalize, target_file, self.current_loop_settings.export_format, mono_path=mono_file)
+        for path in filter(None, [target_file, mono_file]):
+            self.metrics.inc("bytes_written_total", os.path.getsize(path), {"target": "export"})
+            self.log("Exported: " + WeaponFireLoopGenerator.prevent_overflow(path, 44))
+        return diffs
+
+    def sequence_name(self, kind, mono_str, index):
+        return self.current_loop_settings.prefix + "_" + kind + "_" + mono_str + "_" + str(index)
+
+    def loop_target(self, path, mono_str):
+        return lambda i: os.path.join(path, self.sequence_name("loop", mono_str, i) + ".wav")
+
+    def replay_schedule(self, path):
+        schedule = SequenceSchedule.load(path)
+        if schedule.downmix_from:
+            # mono sequences of a fused export are the downmix of the stereo mix, not a mix of mono shots
+            return self.mix_sequence(schedule.mixed_schedule(), True)[1]
+        return self.mix_sequence(schedule)
 
     def log(self, text, display=False):
-        print(text)
+        if self.print_log:
+            print(text)
         self.log_callback(text)
 
-    def generate_list_sequence(self, count):
-        sequence = []
-
-        samples = self.sample_manager.get_samples_list()
-
-        #count = count - 1 # append last shot manually
-
-        solo_samples = list(filter(lambda x: x.solo, samples))
-
-        for i in range(count):
-            rand_idx = numpy.random.randint(len(samples))
-            rand_seed = numpy.random.randint(KINDA_BIG_NUMBER)
-            sample = samples[rand_idx] if len(solo_samples) == 0 else solo_samples[0]
-            sequence.append(sample.render_looped(self.current_loop_settings.mono_loop, rand_seed))
-
-        #rand_idx = numpy.random.randint(len(samples))
-        #rand_seed = numpy.random.randint(KINDA_BIG_NUMBER)
-        #sequence.append(samples[rand_idx].render_default(self.current_loop_settings.mono_loop, rand_seed))
-
-        return sequence
-
-
     def generate_tails(self, variations, seed):
         tails = []
         samples = self.sample_manager.get_samples_list()
-        for sample in samples:
+        cents = [draw_tails(schedule_rng(seed, STREAM_TAIL, i), samples) for i in range(max(variations, 1))]
+        for j in range(len(samples)):
             for i in range(max(variations, 1)):
-                tails.append(sample.render_tail(self.current_loop_settings.mono_tail, numpy.random.randint(KINDA_BIG_NUMBER)))        
+                tails.append(self.render_sample(samples[j], RENDER_TAIL, self.current_loop_settings.mono_tail, int(cents[i][j])))
 
         return tails   
 
     def import_project(self, path):
         f = open(path)
         data = json.load(f)
-        self.set_current_loop_settings(WeaponFireLoopSettings.from_dict(data["loop_settings"]))
+        # cleared first, setting the format would conform the old samples again from their files
         self.sample_manager.clear()
+        self.set_current_loop_settings(WeaponFireLoopSettings.from_dict(data["loop_settings"]))
         for sample in data["sample_props"]:
             self.sample_manager.update_sample(WeaponFireSample.from_dict(sample))
         
@@ -171,15 +322,15 @@ class WeaponFireLoopGenerator:
     
     def export_project(self):
         prefix = self.current_loop_settings.prefix
-        path = self.current_loop_settings.target_path + "\\" + prefix
+        path = os.path.join(self.current_loop_settings.target_path, prefix)
 
         if not os.path.exists(path):
             os.mkdir(path)
 
-        config_path = path + "\\config.json"
+        config_path = os.path.join(path, "config.json")
 
         if os.path.exists(config_path):
-            bak_path = path + "\\config.json.bak"
+            bak_path = os.path.join(path, "config.json.bak")
             if os.path.exists(bak_path):
                 os.remove(bak_path)
             shutil.copy2(config_path, bak_path)
@@ -194,23 +345,247 @@ class WeaponFireLoopGenerator:
             json.dump(to_dump, fp=fp, indent=4, sort_keys=True)
 
         
-    def export_all(self):
+    def export_profiled(self, trace_path, incremental=False):
+        # export_all with every stage timed, writes a chrome trace (chrome://tracing, perfetto) and logs the summary
+        owned = render_profiler.active is None
+        profiler = render_profiler.enable()
+        try:
+            self.export_all(incremental)
+        finally:
+            if owned:
+                render_profiler.disable()
+        profiler.save_trace(trace_path)
+        self.log(profiler.summary_table())
+        return profiler
+
+    def export_all(self, incremental=False):
+        start = time.perf_counter()
+        written = self.metrics.total("bytes_written_total")
+        with stage("export", {"incremental": incremental, "workers": self.export_workers}):
+            self.run_with_inputs(lambda: self.export_render(incremental), incremental or self.render_cache is not None)
+
+        elapsed = time.perf_counter() - start
+        self.metrics.inc("exports_total")
+        self.metrics.set("last_export_seconds", elapsed)
+        self.metrics.set("last_export_bytes_per_second", (self.metrics.total("bytes_written_total") - written) / elapsed if elapsed > 0 else 0.0)
+        if self.metrics_textfile:
+            self.metrics.write_textfile(self.metrics_textfile, {"project": self.current_loop_settings.prefix})
+
+    def export_render(self, incremental=False):
         prefix = self.current_loop_settings.prefix
-        path = self.current_loop_settings.target_path + "\\" + prefix
+        path = os.path.join(self.current_loop_settings.target_path, prefix)
 
         if not os.path.exists(path):
             os.mkdir(path)
         
-        path = path + "\\render"
+        path = os.path.join(path, "render")
+        if incremental:
+            if not os.path.exists(path):
+                os.mkdir(path)
+            self.export_changed(path, self.export_workers)
+            return
+
         if os.path.exists(path):
             shutil.rmtree(path)  
         os.mkdir(path)
 
-        self.export_with(False)
-        self.export_with(True)
+        if self.export_workers > 0:
+            self.export_parallel(path, self.export_workers)
+        elif self.current_loop_settings.fused_mono:
+            self.export_with(False, True)
+        else:
+            self.export_with(False)
+            self.export_with(True)
+
+    def export_parallel(self, path, workers):
+        samples = self.sample_manager.get_samples_list()
+        seed = self.current_loop_settings.seed
+        variations = self.current_loop_settings.variations
+
+        # a fused export only renders stereo, the mono results are downmixed from it
+        fused = self.current_loop_settings.fused_mono
+        passes = [False] if fused else [False, True]
+
+        schedules = {}
+        tasks = {}
+        for mono in passes:
+            schedules[mono] = (self.generate_schedules(True, seed, variations, mono), self.generate_schedules(False, seed, variations, mono))
+            tasks[mono] = export_tasks(self.current_loop_settings, len(samples), mono, schedules[mono][0], schedules[mono][1])
+
+        self.log("Rendering sounds (" + str(workers) + " workers) ...", True)
+        try:
+            results = render_tasks(self, sum(map(lambda x: tasks[x], passes), []), workers)
+        except Exception as e:
+            self.log("Exception while rendering (further information within the log)", True)
+            raise e
+
+        rendered = {}
+        for mono in passes:
+            rendered[mono] = split_results(tasks[mono], results[:len(tasks[mono])])
+            results = results[len(tasks[mono]):]
+        if fused:
+            rendered[False], rendered[True] = split_fused(rendered[False])
+            schedules[True] = tuple(map(lambda x: list(map(lambda y: y.as_mono(), x)), schedules[False]))
+
+        for mono in [False, True]:
+            loops = self.sequence_results(rendered[mono][TASK_LOOP], schedules[mono][1])
+            mono_str = "mono" if mono else "default"
+            self.export_rendered(path, mono_str, rendered[mono][TASK_DEFAULT], rendered[mono][TASK_TAIL], list(map(lambda x: x[0], rendered[mono][TASK_BURST])), loops[0], loops[1], schedules[mono][0], schedules[mono][1])
+
+    def export_changed(self, path, workers=0):
+        # renders only the outputs whose inputs changed since the last export, see render_manifest
+        manifest = RenderManifest.load(path)
+        samples = self.sample_manager.get_samples_list()
+        seed = self.current_loop_settings.seed
+        variations = self.current_loop_settings.variations
+        fused = self.current_loop_settings.fused_mono
+        passes = [False] if fused else [False, True]
+
+        schedules = {}
+        tasks = []
+        for mono in passes:
+            schedules[mono] = (self.generate_schedules(True, seed, variations, mono), self.generate_schedules(False, seed, variations, mono))
+            tasks = tasks + export_tasks(self.current_loop_settings, len(samples), mono, schedules[mono][0], schedules[mono][1])
+        if fused:
+            schedules[True] = tuple(map(lambda x: list(map(lambda y: y.as_mono(), x)), schedules[False]))
+
+        inputs = self.output_inputs(samples, seed, variations)
+        outputs = lambda task: [task[1]] + ([True] if fused else [])
+        stale = list(filter(lambda x: x[0] == TASK_LOOP and any(map(lambda y: not manifest.is_current(self.task_name(x, y), inputs_key(inputs(x, y))), outputs(x))), tasks))
+
+        # defaults and tails are adjusted by the average loop boost, so they follow any changed loop of their pass
+        changed_loops = set(mono for task in stale for mono in outputs(task))
+        boosts = {}
+        for mono in set([False, True]) - changed_loops:
+            boosts[mono] = self.sequence_results(list(map(lambda x: (None, manifest.diff(self.task_name(x, mono))), filter(lambda x: x[0] == TASK_LOOP and mono in outputs(x), tasks))), None)[1]
+        for task in filter(lambda x: x[0] != TASK_LOOP, tasks):
+            keys = list(map(lambda x: (self.task_name(task, x), inputs_key(inputs(task, x, boosts.get(x)))), outputs(task)))
+            if any(map(lambda x: x in changed_loops, outputs(task))) or not all(map(lambda x: manifest.is_current(x[0], x[1]), keys)):
+                stale.append(task)
+
+        self.log("Rendering " + str(len(stale)) + " of " + str(len(tasks)) + " changed sounds ...", True)
+        manifest.invalidate(list(map(lambda x: self.task_name(x[0], x[1]), [(task, mono) for task in stale for mono in outputs(task)])))
+        try:
+            results = self.run_tasks(stale, workers)
+        except Exception as e:
+            self.log("Exception while rendering (further information within the log)", True)
+            raise e
+
+        rendered = {False: [], True: []}
+        for task, result in zip(stale, results):
+            rendered[task[1]].append((task, result))
+            if fused and task[0] in [TASK_BURST, TASK_LOOP]:
+                rendered[False][-1] = (task, result[0])
+                rendered[True].append(((task[0], True) + task[2:], result[1]))
+            elif fused:
+                rendered[True].append(((task[0], True) + task[2:], mono_segment(result)))
+
+        for mono in [False, True]:
+            self.export_changed_pass(path, manifest, mono, rendered[mono], tasks, schedules[mono], inputs, boosts.get(mono))
+
+        names = set(self.task_name(task, mono) for task in tasks for mono in outputs(task))
+        for removed in manifest.remove_orphans(names):
+            self.log("Removed: " + WeaponFireLoopGenerator.prevent_overflow(removed, 44))
+        manifest.save()
+        self.log("Ready", True)
+
+    def export_changed_pass(self, path, manifest, mono, rendered, tasks, schedules, inputs, boost):
+        mono_str = "mono" if mono else "default"
+        tail_variations = max(self.current_loop_settings.variations, 1)
+        count = len(self.sample_manager.samples)
+        results = {TASK_DEFAULT: [None] * count, TASK_TAIL: [None] * (count * tail_variations), TASK_BURST: [None] * len(schedules[0]), TASK_LOOP: [None] * len(schedules[1])}
+        for task, result in rendered:
+            kind, _, index, variation, _ = task
+            results[kind][index * tail_variations + variation if kind == TASK_TAIL else (variation if kind in [TASK_BURST, TASK_LOOP] else index)] = result
+
+        if boost is None:
+            # current loops keep the volume diff they were rendered with
+            loops = list(map(lambda x: results[TASK_LOOP][x] or (None, manifest.diff(self.sequence_name("loop", mono_str, x))), range(len(schedules[1]))))
+            boost = self.sequence_results(loops, None)[1]
+
+        bursts = list(map(lambda x: x[0] if x else None, results[TASK_BURST]))
+        loops = list(map(lambda x: x[0] if x else None, results[TASK_LOOP]))
+        self.export_rendered(path, mono_str, results[TASK_DEFAULT], results[TASK_TAIL], bursts, loops, boost, schedules[0], schedules[1])
+
+        for task, result in rendered:
+            name = self.task_name(task, mono)
+            if task[0] in [TASK_BURST, TASK_LOOP]:
+                manifest.record(name, inputs_key(inputs(task, mono)), [name + ".wav", name + SCHEDULE_EXTENSION], result[1])
+            else:
+                manifest.record(name, inputs_key(inputs(task, mono, boost)), [name + ".wav"])
+
+    def task_name(self, task, mono):
+        kind, _, index, variation, _ = task
+        mono_str = "mono" if mono else "default"
+        if kind == TASK_TAIL:
+            return self.sequence_name("tail", mono_str, index * max(self.current_loop_settings.variations, 1) + variation)
+        return self.sequence_name(kind, mono_str, index if kind == TASK_DEFAULT else variation)
+
+    def output_inputs(self, samples, seed, variations):
+        # everything an output depends on, as plain data for inputs_key
+        settings = self.current_loop_settings
+        tail_cents = [draw_tails(schedule_rng(seed, STREAM_TAIL, i), samples) for i in range(max(variations, 1))]
+
+        def inputs(task, mono, boost=None):
+            kind, _, index, variation, schedule = task
+            result = dict(self.render_inputs(), kind=kind, mono=mono, fused=bool(mono and settings.fused_mono), export_format=settings.export_format)
+            if kind == TASK_DEFAULT:
+                result.update({"sample": self.sample_inputs(samples[index], RENDER_DEFAULT), "boost": boost})
+            elif kind == TASK_TAIL:
+                result.update({"sample": self.sample_inputs(samples[index], RENDER_TAIL), "cents": int(tail_cents[variation][index]), "boost": boost})
+            else:
+                used = list(map(lambda x: self.sample_inputs(self.sample_manager.samples[x], RENDER_LOOPED), schedule.used_paths()))
+                result.update({"schedule": schedule.as_dict(), "samples": used, "normalize": settings.normalize})
+            return result
+
+        return inputs
+
+    def run_tasks(self, tasks, workers):
+        if len(tasks) == 0:
+            return []
+        if workers > 0:
+            return render_tasks(self, tasks, workers)
+
+        old_mono_loop = self.current_loop_settings.mono_loop
+        old_mono_tail = self.current_loop_settings.mono_tail
+        try:
+            return list(map(self.render_task, tasks))
+        finally:
+            self.current_loop_settings.mono_loop = old_mono_loop
+            self.current_loop_settings.mono_tail = old_mono_tail
+
+    def render_task(self, task):
+        kind, mono, index, variation, schedule = task
+        self.current_loop_settings.mono_loop = mono
+        self.current_loop_settings.mono_tail = mono
+        seed = self.current_loop_settings.seed
+        samples = self.sample_manager.get_samples_list()
+
+        if kind == TASK_DEFAULT:
+            return self.render_sample(samples[index], RENDER_DEFAULT, mono)
+
+        if kind == TASK_TAIL:
+            cents = draw_tails(schedule_rng(seed, STREAM_TAIL, variation), samples)
+            return self.render_sample(samples[index], RENDER_TAIL, mono, int(cents[index]))
+
+        start = time.perf_counter()
+        render = self.render_task_sequence(kind, mono, variation, schedule)
+        self.metrics.observe("render_seconds", time.perf_counter() - start, {"output": kind})
+        return render
+
+    def render_task_sequence(self, kind, mono, variation, schedule):
+        # fused tasks only come for stereo and return the stereo and the downmixed mono sequence
+        fused = self.current_loop_settings.fused_mono and not mono
+        if kind == TASK_LOOP and self.current_loop_settings.stream_loops:
+            path = os.path.join(self.current_loop_settings.target_path, self.current_loop_settings.prefix, "render")
+            mono_target = self.loop_target(path, "mono")(variation) if fused else None
+            diffs = self.stream_sequence(schedule, self.loop_target(path, "mono" if mono else "default")(variation), mono_target)
+            return ((None, diffs[0]), (None, diffs[1])) if fused else (None, diffs[0])
+
+        return self.mix_sequence(schedule, fused)
 
     
-    def export_with(self, mono):
+    def export_with(self, mono, fused=False):
         old_mono_loop = self.current_loop_settings.mono_loop
         old_mono_tail = self.current_loop_settings.mono_tail
 
@@ -218,7 +593,7 @@ class WeaponFireLoopGenerator:
         self.current_loop_settings.mono_tail = mono
 
         try:
-            self.export_sounds()
+            self.export_sounds(fused)
         except Exception as e:
             self.current_loop_settings.mono_loop = old_mono_loop
             self.current_loop_settings.mono_tail = old_mono_tail
@@ -228,9 +603,9 @@ class WeaponFireLoopGenerator:
         self.current_loop_settings.mono_loop = old_mono_loop
         self.current_loop_settings.mono_tail = old_mono_tail
 
-    def export_sounds(self):
+    def export_sounds(self, fused=False):
         prefix = self.current_loop_settings.prefix
-        path = self.current_loop_settings.target_path + "\\" + prefix + "\\render"
+        path = os.path.join(self.current_loop_settings.target_path, prefix, "render")
 
         variations = self.current_loop_settings.variations
 
@@ -240,40 +615,52 @@ class WeaponFireLoopGenerator:
 
         self.log("Generating sounds (" + mono_str + ") ...", True)
         self.log("Rendering defaults (" + mono_str + ") ...", True)
-        defaults = list(map(lambda x: x.render_default(self.current_loop_settings.mono_loop or self.current_loop_settings.mono_tail, 0, True), self.sample_manager.get_samples_list()))
+        defaults = list(map(lambda x: self.render_sample(x, RENDER_DEFAULT, self.current_loop_settings.mono_loop or self.current_loop_settings.mono_tail), self.sample_manager.get_samples_list()))
         self.log("Rendering tails (" + mono_str + ") ...", True)
         tails = self.generate_tails(variations, seed)
         self.log("Rendering bursts (" + mono_str + ") ...", True)
-        bursts = self.generate_sequences(True, seed, variations)[0] # make sure burst and are not the same partially
+        bursts = self.generate_sequences(True, seed, variations, None, fused)
         self.log("Rendering loops (" + mono_str + ") ...", True)
-        loops = self.generate_sequences(False, seed * 1000, variations)
+        loops = self.generate_sequences(False, seed, variations, path if self.current_loop_settings.stream_loops else None, fused)
 
-        volume_boost_loop = loops[1]
+        if not fused:
+            self.export_rendered(path, mono_str, defaults, tails, bursts[0], loops[0], loops[1], bursts[2], loops[2])
+            return
 
+        self.export_rendered(path, mono_str, defaults, tails, bursts[0][0], loops[0][0], loops[0][1], bursts[0][2], loops[0][2])
+        self.log("Downmixing defaults and tails (mono) ...", True)
+        self.export_rendered(path, "mono", list(map(mono_segment, defaults)), list(map(mono_segment, tails)), bursts[1][0], loops[1][0], loops[1][1], bursts[1][2], loops[1][2])
+
+    def export_rendered(self, path, mono_str, defaults, tails, bursts, loops, volume_boost_loop, burst_schedules, loop_schedules):
         if volume_boost_loop > 0:
             self.log("Adjusting volumes (tails, defaults) (" + mono_str + ") ...", True)
-            tails = list(map(lambda tail: tail + min(-tail.max_dBFS - 0.01, volume_boost_loop), tails))
-            defaults = list(map(lambda default: default + min(-default.max_dBFS - 0.01, volume_boost_loop), defaults))
+            with stage("gain adjust", {"output": mono_str}):
+                tails = list(map(lambda tail: tail + min(-tail.max_dBFS - 0.01, volume_boost_loop) if tail is not None else None, tails))
+                defaults = list(map(lambda default: default + min(-default.max_dBFS - 0.01, volume_boost_loop) if default is not None else None, defaults))
 
         self.log("Exporting files (" + mono_str + ") ...", True)
 
-        prefix = self.current_loop_settings.prefix
-
         self.log("Exporting defaults (" + mono_str + ") ...", True)
-        for i in range(len(defaults)):
-            self.export_audio_segment(path, defaults[i], prefix + "_default_" + mono_str + "_" + str(i))
+        # unchanged outputs of an incremental export come as None
+        for i in filter(lambda x: defaults[x] is not None, range(len(defaults))):
+            self.export_audio_segment(path, defaults[i], self.sequence_name("default", mono_str, i))
 
         self.log("Exporting tails (" + mono_str + ") ...", True)
-        for i in range(len(tails)):
-            self.export_audio_segment(path, tails[i], prefix + "_tail_" + mono_str + "_" + str(i))
+        for i in filter(lambda x: tails[x] is not None, range(len(tails))):
+            self.export_audio_segment(path, tails[i], self.sequence_name("tail", mono_str, i))
         
         self.log("Exporting bursts (" + mono_str + ") ...", True)
         for i in range(len(bursts)):
-            self.export_audio_segment(path, bursts[i], prefix + "_burst_" + mono_str + "_" + str(i))
+            if bursts[i] is not None:
+                self.export_audio_segment(path, bursts[i], self.sequence_name("burst", mono_str, i))
+            burst_schedules[i].save(os.path.join(path, self.sequence_name("burst", mono_str, i) + SCHEDULE_EXTENSION))
 
         self.log("Exporting loops (" + mono_str + ") ...", True)
-        for i in range(len(loops[0])):
-            self.export_audio_segment(path, loops[0][i], prefix + "_loop_" + mono_str + "_" + str(i))
+        for i in range(len(loops)):
+            # streamed loops are already written
+            if loops[i] is not None:
+                self.export_audio_segment(path, loops[i], self.sequence_name("loop", mono_str, i))
+            loop_schedules[i].save(os.path.join(path, self.sequence_name("loop", mono_str, i) + SCHEDULE_EXTENSION))
         
         self.log("Ready", True)
 
@@ -281,7 +668,7 @@ class WeaponFireLoopGenerator:
         if len(self.sample_manager.get_samples_list()) > 0:
             self.log("Rendering preview burst ...", True)
             seed = self.current_loop_settings.seed
-            bursts = self.generate_sequences(True, seed)
+            bursts = self.run_with_inputs(lambda: self.generate_sequences(True, seed), self.render_cache is not None)
             self.current_preview = bursts[0][0]
             self.log("Ready", True)
 
@@ -289,7 +676,7 @@ class WeaponFireLoopGenerator:
         if len(self.sample_manager.get_samples_list()) > 0:
             self.log("Rendering preview loop ...", True)
             seed = self.current_loop_settings.seed
-            bursts = self.generate_sequences(False, seed)
+            bursts = self.run_with_inputs(lambda: self.generate_sequences(False, seed), self.render_cache is not None)
             self.current_preview = bursts[0][0]
             self.log("Ready", True)
     
@@ -299,7 +686,10 @@ class WeaponFireLoopGenerator:
 
     def reload_samples(self):
         self.log("Reloading samples ...", True)
-        self.sample_manager.reload_samples()
+        reloaded = self.sample_manager.reload_samples()
+        for path in reloaded:
+            self.log("Reloaded: " + WeaponFireLoopGenerator.prevent_overflow(path, 44))
+        self.log("Reloaded " + str(len(reloaded)) + " of " + str(len(self.sample_manager.samples)) + " samples", True)
         samples = self.sample_manager.get_samples_list()
         if len(samples) > 0:
             self.current_sample = samples[0]
@@ -313,25 +703,32 @@ class WeaponFireLoopGenerator:
 
     def play_audio(self, audio):
         self.export_audio_segment(self.current_loop_settings.target_path, audio, "preview_temp")
-        path = self.current_loop_settings.target_path + "\\preview_temp.wav"
+        path = os.path.join(self.current_loop_settings.target_path, "preview_temp.wav")
         log_path = WeaponFireLoopGenerator.prevent_overflow(path, 44) # prevent overflow 
         self.log("Playback " + log_path, True)
+        # playback is windows only, keep it out of headless imports
+        import winsound
         winsound.PlaySound(path, winsound.SND_FILENAME)
         self.log("Ready", True)  
 
     def export_audio_segment(self, path, audio_segment, name):
-        target_file = path + "\\" + name + ".wav"
-        audio_segment.export(target_file, format="wav")
+        target_file = os.path.join(path, name + ".wav")
+        with stage("write", {"path": target_file}):
+            export_wav(audio_segment, target_file, self.current_loop_settings.export_format)
+        self.metrics.inc("bytes_written_total", os.path.getsize(target_file), {"target": "export"})
         log_path = WeaponFireLoopGenerator.prevent_overflow(target_file, 44) # prevent overflow
         self.log("Exported: " + log_path)
 
+    def random_cents(self, sample):
+        return int(draw_cents(numpy.random.default_rng(), numpy.array([sample.rand_offset_cents]))[0])
+
     def play_current_loop_sample(self):
         if self.current_sample:
-            self.play_audio(self.current_sample.render_looped(self.current_loop_settings.mono_loop, numpy.random.randint(KINDA_BIG_NUMBER)))
+            self.play_audio(self.current_sample.render(RENDER_LOOPED, self.current_loop_settings.mono_loop, self.random_cents(self.current_sample), self.render_engine))
 
     def play_current_tail_sample(self):
         if self.current_sample:
-            self.play_audio(self.current_sample.render_tail(self.current_loop_settings.mono_tail, numpy.random.randint(KINDA_BIG_NUMBER)))
+            self.play_audio(self.current_sample.render(RENDER_TAIL, self.current_loop_settings.mono_tail, self.random_cents(self.current_sample), self.render_engine))
 
 if __name__ == '__main__':
     import weapon_fire_loop_generator_ui
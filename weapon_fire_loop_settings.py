@@ -10,13 +10,23 @@ DEFAULT_NORMALIZE = True
 DEFAULT_MONO_LOOP = True
 DEFAULT_MONO_TAIL = False
 DEFAULT_VARIATIONS = 3
-DEFAULT_TARGET_PATH = os.getcwd() + "\\results"
+# project format the sources are conformed to, None follows the largest source
+DEFAULT_FRAME_RATE = None
+DEFAULT_SAMPLE_WIDTH = None
+DEFAULT_CHANNELS = None
+# bit depth of the exported wavs, None keeps the project sample width
+DEFAULT_EXPORT_FORMAT = None
+# loops are mixed block by block straight into their files, for very long loops
+DEFAULT_STREAM_LOOPS = False
+# mono files are downmixed from the stereo renders instead of being rendered in a second pass, off keeps the mono output of existing projects
+DEFAULT_FUSED_MONO = False
+DEFAULT_TARGET_PATH = os.path.join(os.getcwd(), "results")
 
 if not os.path.exists(DEFAULT_TARGET_PATH):
     os.mkdir(DEFAULT_TARGET_PATH)
 
 class WeaponFireLoopSettings:
-    def __init__(self, fire_count, burst_count, rpm, rpm_burst, seed, normalize, mono_loop, mono_tail, prefix, target_path, variations):
+    def __init__(self, fire_count, burst_count, rpm, rpm_burst, seed, normalize, mono_loop, mono_tail, prefix, target_path, variations, frame_rate, sample_width, channels, export_format, stream_loops, fused_mono):
         self.fire_count = fire_count
         self.burst_count = burst_count
         self.rpm = rpm
@@ -28,15 +38,21 @@ class WeaponFireLoopSettings:
         self.prefix = prefix
         self.target_path = target_path
         self.variations = variations
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.export_format = export_format
+        self.stream_loops = stream_loops
+        self.fused_mono = fused_mono
 
     @staticmethod
-    def create(prefix=DEFAULT_PREFIX, seed=DEFAULT_SEED, fire_count=DEFAULT_FIRE_COUNT, burst_count=DEFAULT_BURST_COUNT, rpm=DEFAULT_RPM, rpm_burst=DEFAULT_RPM_BURST, normalize=DEFAULT_NORMALIZE, mono_loop=DEFAULT_MONO_LOOP, mono_tail=DEFAULT_MONO_TAIL, target_path=DEFAULT_TARGET_PATH, variations=DEFAULT_VARIATIONS):
-        return WeaponFireLoopSettings(max(fire_count, 1), max(burst_count, 1), max(rpm, 1), max(rpm_burst, 1), seed, normalize, mono_loop, mono_tail, prefix, target_path, variations)
+    def create(prefix=DEFAULT_PREFIX, seed=DEFAULT_SEED, fire_count=DEFAULT_FIRE_COUNT, burst_count=DEFAULT_BURST_COUNT, rpm=DEFAULT_RPM, rpm_burst=DEFAULT_RPM_BURST, normalize=DEFAULT_NORMALIZE, mono_loop=DEFAULT_MONO_LOOP, mono_tail=DEFAULT_MONO_TAIL, target_path=DEFAULT_TARGET_PATH, variations=DEFAULT_VARIATIONS, frame_rate=DEFAULT_FRAME_RATE, sample_width=DEFAULT_SAMPLE_WIDTH, channels=DEFAULT_CHANNELS, export_format=DEFAULT_EXPORT_FORMAT, stream_loops=DEFAULT_STREAM_LOOPS, fused_mono=DEFAULT_FUSED_MONO):
+        return WeaponFireLoopSettings(max(fire_count, 1), max(burst_count, 1), max(rpm, 1), max(rpm_burst, 1), seed, normalize, mono_loop, mono_tail, prefix, target_path, variations, frame_rate, sample_width, channels, export_format, stream_loops, fused_mono)
 
     def as_dict(self):
         as_dict = self.__dict__
         for key in as_dict: 
-            if type(as_dict[key]) == numpy.int32: #does not support json 
+            if isinstance(as_dict[key], numpy.integer): #does not support json 
                 as_dict[key] = int(as_dict[key])
         return as_dict
 
@@ -74,6 +90,27 @@ class WeaponFireLoopSettings:
         if "target_path" in src:
             result.target_path = src["target_path"]
 
+        if "variations" in src:
+            result.variations = max(src["variations"], 0)
+
+        if "frame_rate" in src:
+            result.frame_rate = src["frame_rate"]
+
+        if "sample_width" in src:
+            result.sample_width = src["sample_width"]
+
+        if "channels" in src:
+            result.channels = src["channels"]
+
+        if "export_format" in src:
+            result.export_format = src["export_format"]
+
+        if "stream_loops" in src:
+            result.stream_loops = src["stream_loops"]
+
+        if "fused_mono" in src:
+            result.fused_mono = src["fused_mono"]
+
         return result
 
     
@@ -1,7 +1,8 @@
-from pydub import AudioSegment
-from pydub.playback import play
-from pydub.effects import normalize, strip_silence
-import numpy, math, os, sys, json
+from memory_lru import MemoryBoundedLRU
+from audio_bridge import segment_nbytes
+from fade_envelope import FADE_LINEAR, FADE_CURVES
+from render_engine import PydubRenderEngine, RENDER_DEFAULT, RENDER_TAIL, RENDER_LOOPED
+import numpy
 
 DEFAULT_HEADROOM = -6
 DEFAULT_RAND_OFFSET_CENTS = 24
@@ -9,12 +10,16 @@ DEFAULT_LOOP_FADEOUT_START_MS = 120
 DEFAULT_LOOP_FADOUT_LENGTH_MS = 48
 DEFAULT_TAIL_OFFSET_MS = 36
 DEFAULT_TAIL_FADEIN_MS = 30
-STRIP_SILENCE_THRESHOLD = -72
-MAX_SILENCE_LENGTH = 111
-SILENCE = -120
+DEFAULT_FADE_CURVE = FADE_LINEAR
+DEFAULT_PITCH_CACHE_BYTES = 8 * 1024 * 1024
+
+PYDUB_ENGINE = PydubRenderEngine.create()
+
+def variant_nbytes(variant):
+    return segment_nbytes(variant[1])
 
 class WeaponFireSample:
-    def __init__(self, source_sound, path, name, headroom, rand_offset_cents, loop_fadeout_start_ms, loop_fadeout_length_ms, tail_offset_ms, tail_fadein_ms, solo):
+    def __init__(self, source_sound, path, name, headroom, rand_offset_cents, loop_fadeout_start_ms, loop_fadeout_length_ms, tail_offset_ms, tail_fadein_ms, solo, fade_curve):
         self.source_sound = source_sound
         self.path = path
         self.name = name 
@@ -25,6 +30,39 @@ class WeaponFireSample:
         self.tail_offset_ms = tail_offset_ms
         self.tail_fadein_ms = tail_fadein_ms
         self.solo = solo
+        self.fade_curve = fade_curve
+        self._render_cache = {}
+        self._pitch_variants = MemoryBoundedLRU.create(DEFAULT_PITCH_CACHE_BYTES, variant_nbytes, self.evicted_variant)
+        self._source_loader = None
+        self._metrics = None
+
+    @property
+    def source_sound(self):
+        # lazy samples get their source from the loader, which may decode it again after an eviction
+        if self._source_sound is None and self._source_loader:
+            return self._source_loader(self)
+        return self._source_sound
+
+    @source_sound.setter
+    def source_sound(self, source):
+        self._source_sound = source
+
+    def resident_source(self):
+        return self._source_sound
+
+    def set_source_loader(self, loader):
+        self._source_loader = loader
+
+    def set_metrics(self, metrics):
+        # the cache counters of the sample manager the sample belongs to
+        self._metrics = metrics
+
+    def count_cache(self, name, cache):
+        if self._metrics is not None:
+            self._metrics.inc(name, labels={"cache": cache})
+
+    def evicted_variant(self, key, variant):
+        self.count_cache("memory_cache_evictions_total", "pitch")
     
     def __str__(self):
         return self.name + ": " + self.path
@@ -32,11 +70,19 @@ class WeaponFireSample:
     def __eq__(self, other):
         return self.path == other.path
 
+    def __getstate__(self):
+        # render caches are rebuilt on the other side instead of being pickled
+        state = self.__dict__.copy()
+        state["_render_cache"] = {}
+        state["_pitch_variants"] = MemoryBoundedLRU.create(self._pitch_variants.max_bytes, variant_nbytes, self.evicted_variant)
+        state["_source_loader"] = None
+        state["_metrics"] = None
+        return state
+
     def as_dict(self):
-        as_dict = self.__dict__.copy()
-        as_dict.pop("source_sound")
+        as_dict = dict(filter(lambda x: not x[0].startswith("_"), self.__dict__.items()))
         for key in as_dict: 
-            if type(as_dict[key]) == numpy.int32: #does not support json 
+            if isinstance(as_dict[key], numpy.integer): #does not support json 
                 as_dict[key] = int(as_dict[key])
         return as_dict
 
@@ -65,83 +111,83 @@ class WeaponFireSample:
 
         if "solo" in src:
             result.solo = bool(src["solo"])
+
+        if "fade_curve" in src:
+            result.set_fade_curve(str(src["fade_curve"]))
         
         return result
 
     @staticmethod
-    def create(source_sound, path, name, headroom=DEFAULT_HEADROOM, rand_offset_cents=DEFAULT_RAND_OFFSET_CENTS, loop_fadeout_start_ms=DEFAULT_LOOP_FADEOUT_START_MS, loop_fadeout_length_ms=DEFAULT_LOOP_FADOUT_LENGTH_MS, tail_offset_ms=DEFAULT_TAIL_OFFSET_MS, tail_fadein_ms=DEFAULT_TAIL_FADEIN_MS, solo=False):
+    def create(source_sound, path, name, headroom=DEFAULT_HEADROOM, rand_offset_cents=DEFAULT_RAND_OFFSET_CENTS, loop_fadeout_start_ms=DEFAULT_LOOP_FADEOUT_START_MS, loop_fadeout_length_ms=DEFAULT_LOOP_FADOUT_LENGTH_MS, tail_offset_ms=DEFAULT_TAIL_OFFSET_MS, tail_fadein_ms=DEFAULT_TAIL_FADEIN_MS, solo=False, fade_curve=DEFAULT_FADE_CURVE):
         if source_sound:
             len_source = len(source_sound)
             loop_fadeout_start_ms = numpy.clip(loop_fadeout_start_ms, 0, len_source)
             loop_fadeout_length_ms = numpy.clip(loop_fadeout_length_ms, 0, len_source - loop_fadeout_start_ms)
             tail_offset_ms = numpy.clip(tail_offset_ms, 0, len_source)
             tail_fadein_ms = numpy.clip(tail_fadein_ms, 0, len_source - tail_offset_ms)
-        return WeaponFireSample(source_sound, path, name, min(headroom, -0.01), abs(rand_offset_cents), loop_fadeout_start_ms, loop_fadeout_length_ms, tail_offset_ms, tail_fadein_ms, solo)
+        if fade_curve not in FADE_CURVES:
+            raise ValueError("Unknown fade curve: " + str(fade_curve))
+        return WeaponFireSample(source_sound, path, name, min(headroom, -0.01), abs(rand_offset_cents), loop_fadeout_start_ms, loop_fadeout_length_ms, tail_offset_ms, tail_fadein_ms, solo, fade_curve)
 
     def set_headroom(self, target):
         self.headroom = min(target, -0.01)
 
-    def random_pitch_from_seed(self, seed):
-        numpy.random.seed(seed)
-        total_range = 2 * self.rand_offset_cents
-        rand_val = numpy.random.randint(total_range)
-        return rand_val - (total_range / 2.0)
-
-    def process_render(self, render, seed, skip_pitch=False):
-        processed = strip_silence(render, MAX_SILENCE_LENGTH, STRIP_SILENCE_THRESHOLD)
-        if not skip_pitch: 
-            processed = self.pitch(processed, self.random_pitch_from_seed(seed))
-        return processed 
-
-    def pitch(self, audio, cents):
-        octaves = cents / 1200.0
-        old_sample_rate = audio.frame_rate
-        new_sample_rate = int(old_sample_rate * (2.0 ** octaves))
-
-        pitched = audio._spawn(audio.raw_data, overrides={'frame_rate': new_sample_rate})
-        pitched = pitched.set_frame_rate(old_sample_rate)
+    def set_fade_curve(self, curve):
+        if curve not in FADE_CURVES:
+            raise ValueError("Unknown fade curve: " + str(curve))
+        self.fade_curve = curve
+
+    def render_params(self, kind):
+        if kind == RENDER_LOOPED:
+            return (self.headroom, self.loop_fadeout_start_ms, self.loop_fadeout_length_ms, self.fade_curve)
+        if kind == RENDER_TAIL:
+            return (self.headroom, self.tail_offset_ms, self.tail_fadein_ms, self.fade_curve)
+        return (self.headroom,)
+
+    def prepare(self, kind, mono, engine):
+        # everything before pitch only depends on the source and the render params
+        key = (engine.name, kind, mono)
+        params = self.render_params(kind)
+        source = self.source_sound
+        cached = self._render_cache.get(key)
+        if cached and cached[0] is source and cached[1] == params:
+            self.count_cache("memory_cache_hits_total", "prepared")
+            return cached[2]
+
+        self.count_cache("memory_cache_misses_total", "prepared")
+        prepared = engine.prepare(self, kind, mono)
+        if hasattr(prepared, "samples"):
+            prepared.samples.flags.writeable = False
+        self._render_cache[key] = (source, params, prepared)
+        return prepared
+
+    def clear_render_cache(self):
+        self._render_cache = {}
+        self._pitch_variants.clear()
+
+    def set_pitch_cache_size(self, max_bytes):
+        self._pitch_variants.resize(max_bytes)
+
+    def render(self, kind, mono, cents=None, engine=None):
+        engine = engine or PYDUB_ENGINE
+        render = self.prepare(kind, mono, engine)
+        if cents is None:
+            return engine.to_segment(render)
+
+        # cents are whole numbers, so each sample only ever has a few distinct variants
+        key = (engine.name, engine.quality, kind, mono, cents)
+        variant = self._pitch_variants.get(key)
+        if variant and variant[0] is render:
+            self.count_cache("memory_cache_hits_total", "pitch")
+            return variant[1]
+
+        self.count_cache("memory_cache_misses_total", "pitch")
+        pitched = engine.to_segment(engine.pitch(render, cents))
+        self._pitch_variants.put(key, (render, pitched))
         return pitched
 
-    def render_default(self, mono, seed, skip_pitch=False):
-        default = self.source_sound
-
-        default = normalize(default, abs(self.headroom))
-
-        if mono:
-            default = default.set_channels(1)
-
-        return self.process_render(default, seed, skip_pitch)
-
-    def render_tail(self, mono, seed):
-        tail = self.source_sound
-
-        tail = normalize(tail, abs(self.headroom))
-
-        if mono:
-            tail = tail.set_channels(1)
-
-        if self.tail_offset_ms > 0 and self.tail_fadein_ms > 0:
-            offset = -numpy.clip(len(tail) - self.tail_offset_ms, 0, len(tail))
-            tail = tail[offset:]
-            tail = tail.fade(from_gain=SILENCE, start=0, duration=self.tail_fadein_ms)
-
-        return self.process_render(tail, seed)
-
-    def render_looped(self, mono, seed):
-        looped = self.source_sound
-
-        looped = normalize(looped, abs(self.headroom))
-
-        if mono:
-            looped = looped.set_channels(1)
-        
-        if self.loop_fadeout_start_ms > 0 and self.loop_fadeout_length_ms > 0:
-            looped = looped.fade(to_gain=SILENCE, start=self.loop_fadeout_start_ms, duration=self.loop_fadeout_length_ms)
-        
-        return self.process_render(looped, seed)
-    
     def get_volumes(self, mono=False):
-        render = self.render_default(mono, 42, True)
+        render = self.render(RENDER_DEFAULT, mono)
         return (round(render.max_dBFS, 2), round(render.dBFS, 2))
 
         
\ No newline at end of file